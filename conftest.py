@@ -0,0 +1,24 @@
+import pytest
+
+from hsm.hsm import HsmMixin
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "hsm_strict: The test relies on the checks of the strict mode"
+    )
+    config.addinivalue_line(
+        "markers", "slow: The test takes seconds, deselect with '-m \"not slow\"'"
+    )
+
+
+@pytest.fixture(autouse=True, params=["strict", "production"])
+def hsm_production(request, monkeypatch) -> bool:
+    """
+    Every test runs in strict and in production mode, see 'HsmMixin.hsm_production'.
+    """
+    production = request.param == "production"
+    if production and request.node.get_closest_marker("hsm_strict") is not None:
+        pytest.skip("The test relies on the checks of the strict mode")
+    monkeypatch.setattr(HsmMixin, "hsm_production", production)
+    return production
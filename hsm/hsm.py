@@ -1,22 +1,33 @@
+import array
 import collections
 import dataclasses
 import enum
 import inspect
 import io
-import itertools
 import pathlib
+import sys
+import threading
 import types
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
+    Deque,
     Dict,
+    FrozenSet,
     Iterable,
     List,
     Optional,
     Protocol,
+    Tuple,
+    Union,
+    cast,
     runtime_checkable,
 )
 
+if TYPE_CHECKING:
+    from hsm import hsm_diagram
+
 __version__ = "1.0.3"
 
 
@@ -30,8 +41,6 @@ class _Verb(enum.Enum):
         return self.value
 
 
-_MERMAID_INDENT = "    "
-
 LogFunction = Callable[[str], None]
 StateChangeFunction = Callable[["HsmState", "HsmState"], None]
 
@@ -40,33 +49,99 @@ SignalType = Any
 We only require the __str__ method of the signal.
 Therefore, the signal may be of any type.
 """
-StateType = Callable[[SignalType], None]
+StateType = Callable[[Any, SignalType], Any]
+"""
+A state handler, entry- or exit-action: 'fn(self, signal)'.
+"""
 EntryType = StateType
 ExitType = StateType
 
+HsmStateMask = FrozenSet[int]
+"""
+The 'state_id's of some states including all their substates.
+See 'HsmMixin.hsm_mask()' and 'HsmMixin.current_state_in()'.
+"""
+
 _HSM_INIT_INITSTATE = "hsm_init"
 _HSM_VALUE = "hsm_value"
+_HSM_ON = "hsm_on"
+_HSM_ON_TO = "hsm_on_to"
+
+_LOCK_TOPOLOGY = threading.Lock()
 
 
 class StateChangeException(Exception):
     def __init__(self, fn_new_state: Callable, why: str = None):
-        assert isinstance(fn_new_state, types.MethodType)
-        assert isinstance(why, (type(None), str))
         Exception.__init__(self, f"New state is: {fn_new_state.__name__}")
         self.fn_new_state = fn_new_state
         self.why = why
 
+    def assert_valid(self) -> None:
+        """
+        Called by the dispatcher in strict mode, see 'HsmMixin.hsm_production'.
+        """
+        assert isinstance(self.fn_new_state, types.MethodType)
+        assert isinstance(self.why, (type(None), str))
+
 
 class IgnoreEventException(Exception):
     def __init__(self, why: str = None):
-        assert isinstance(why, (type(None), str))
         self.why = why
 
+    def assert_valid(self) -> None:
+        """
+        Called by the dispatcher in strict mode, see 'HsmMixin.hsm_production'.
+        """
+        assert isinstance(self.why, (type(None), str))
+
 
 class DontChangeStateException(Exception):
     pass
 
 
+class _Handled:
+    def __repr__(self) -> str:
+        return "HANDLED"
+
+
+HANDLED = _Handled()
+"""
+Returned by a state handler: The signal was handled, no state change.
+Same as 'raise DontChangeStateException()'.
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class Ignore:
+    """
+    Returned by a state handler: Empty transition.
+    Same as 'raise IgnoreEventException(why)'.
+    """
+
+    why: str = None
+
+
+IGNORED = Ignore()
+
+
+@dataclasses.dataclass(frozen=True)
+class Transition:
+    """
+    Returned by a state handler: Change the state.
+    Same as 'raise StateChangeException(target, why)'.
+
+    Instead of a 'Transition', a state handler may also just return the
+    target: A handle like 'self.hsm_states.state_TopA' or a method like 'self.state_TopA'.
+    """
+
+    target: Union["HsmState", StateType]
+    why: str = None
+
+
+StateResult = Union[None, _Handled, Ignore, Transition, "HsmState", StateType]
+"The value returned by a state handler"
+
+
 class BadStatemachineException(Exception):
     def __init__(self, msg: str):
         Exception.__init__(self, msg)
@@ -76,10 +151,20 @@ class BadStateException(Exception):
     pass
 
 
+def _is_func_or_method(f: Any, expected_python_type=types.FunctionType) -> bool:
+    is_python = isinstance(f, expected_python_type)
+    is_cython = f.__class__.__name__ == "cython_function_or_method"
+    return is_python or is_cython
+
+
 def _assert_is_func_or_method(f: Callable, expected_python_type=types.FunctionType):
-    assert_python = isinstance(f, expected_python_type)
-    assert_cython = f.__class__.__name__ == "cython_function_or_method"
-    assert assert_python or assert_cython
+    assert _is_func_or_method(f, expected_python_type)
+
+
+def _not_handled(signal: SignalType, state: "HsmState") -> Exception:
+    return Exception(  # pylint: disable=broad-exception-raised
+        f"Signal {signal} was not handled by state_{state.full_name}!"
+    )
 
 
 def init_state(f: Callable[[Any, SignalType], Any]) -> Callable[[Any, SignalType], Any]:
@@ -114,74 +199,291 @@ def value(v: int):
     return inner
 
 
-@dataclasses.dataclass(frozen=True, repr=True)
-class _Transition:
-    when: str
-    state_from: "HsmState" = dataclasses.field(repr=False)
-    state_to: "HsmState" = dataclasses.field(repr=False)
+def on(*signals: SignalType, to: Union[str, "_Handled", "Ignore"] = None):
+    """
+    Decorator to declare the signals handled by a state.
+    The state handler will only be called for these signals: For all other
+    signals, the dispatcher directly continues with the outer state.
+    If all states of a statemachine are decorated, an unhandled signal
+    is rejected without calling any state handler.
+
+    'to' declares the result for these signals, the state handler is then
+    not called for them: The name of the target state like 'state_TopB',
+    'HANDLED' or 'IGNORED'.
+    If all signals of a statemachine are declared like this, the statemachine
+    may be driven by 'hsm_table.HsmTable'.
+
+    The signals must be hashable.
+    May be applied more than once.
+    """
 
-    def link(self) -> None:
-        self.state_from.transitions_from.append(self)
-        self.state_to.transitions_to.append(self)
+    def inner(f: Callable[[Any, SignalType], Any]) -> Callable[[Any, SignalType], Any]:
+        _assert_is_func_or_method(f)
+
+        err = f"'{f.__name__}()' does NOT start with '{_Verb.STATE.value}'. It may not be decorated by 'on'!"
+        if not f.__name__.startswith(_Verb.STATE.value):
+            raise BadStatemachineException(err)
+        setattr(f, _HSM_ON, getattr(f, _HSM_ON, frozenset()) | frozenset(signals))
+        if to is not None:
+            err = f"'{f.__name__}()': @hsm.on(to={to!r}) expects the name of a state, 'HANDLED' or 'IGNORED'!"
+            is_state_name = isinstance(to, str) and to.startswith(_Verb.STATE.value)
+            if not (is_state_name or isinstance(to, (_Handled, Ignore))):
+                raise BadStatemachineException(err)
+            declared = dict(getattr(f, _HSM_ON_TO, {}))
+            declared.update(dict.fromkeys(signals, to))
+            setattr(f, _HSM_ON_TO, declared)
+        return f
+
+    return inner
+
+
+@dataclasses.dataclass(frozen=True)
+class _TransitionPlan:
+    """
+    The precomputed exit/entry-actions for a transition
+    from a state to a target state.
+    """
+
+    state_before: "HsmState"
+    state_target: "HsmState"
+    "The state as requested by the state handler"
+    state_after: "HsmState"
+    "The init-state of 'state_target'"
+    actions: Tuple[Callable, ...]
+    "The exit- and entry-actions in the order to be called"
+    names: Tuple[str, ...]
+    "The names of the actions as required by the loggers"
 
     @staticmethod
-    def parse_docstring(state: "HsmState", doc: Optional[str]) -> None:
+    def build(state_before: "HsmState", state_target: "HsmState") -> "_TransitionPlan":
+        state_after = state_target.resolve_init_state()
+
+        # The toppest state which is not left by this transition
+        states_before = set(state_before.iter_outer_states())
+        toppest_state = state_after
+        while toppest_state not in states_before:
+            toppest_state = toppest_state.outer_state
+
+        actions: List[Callable] = []
+
+        # Exit-Actions
+        state = state_before
+        while state is not toppest_state:
+            if state.fn_exit is not None:
+                actions.append(state.fn_exit)
+            state = state.outer_state
+
+        # Entry-Actions
+        entry_actions: List[Callable] = []
+        state = state_after
+        while state is not toppest_state:
+            if state.fn_entry is not None:
+                entry_actions.append(state.fn_entry)
+            state = state.outer_state
+        actions.extend(reversed(entry_actions))
+
+        return _TransitionPlan(
+            state_before=state_before,
+            state_target=state_target,
+            state_after=state_after,
+            actions=tuple(actions),
+            names=tuple(fn.__name__ for fn in actions),
+        )
+
+
+# Read-only and shared by all leaf states: 'find_state()' replaces it by a dict
+_EMPTY_SUBSTATES: Dict[str, "HsmState"] = types.MappingProxyType({})  # type: ignore[assignment]
+
+
+class HsmState:
+    """
+    A state of the statemachine.
+    The states belong to the 'HsmTopology' of the class and are shared
+    by all instances: 'fn_state', 'fn_entry' and 'fn_exit' are therefore
+    unbound functions and have to be called with the instance as first argument.
+
+    'path', 'full_name' and 'depth' are computed when the state is created,
+    'state_id' and 'state_id_last' when the topology is frozen.
+    The ids are assigned in depth first order: The substates of a
+    state have the ids 'state_id+1' up to 'state_id_last'.
+    After 'freeze()', the attributes may not be changed anymore.
+    """
+
+    __slots__ = (
+        "topology",
+        "name",
+        "outer_state",
+        "path",
+        "full_name",
+        "depth",
+        "state_id",
+        "state_id_last",
+        "fn_state",
+        "fn_handle",
+        "fn_entry",
+        "fn_exit",
+        "init_state",
+        "substates",
+        "plans",
+        "signals",
+        "signal_table",
+        "signal_chain_default",
+        "signal_results",
+        "_frozen",
+    )
+    _frozen: bool
+
+    def __init__(
+        self,
+        topology: "HsmTopology",
+        name: str = None,
+        outer_state: "HsmState" = None,
+    ):
+        object.__setattr__(self, "_frozen", False)
+        self.topology = topology
+        self.name = name
+        self.outer_state = outer_state
+        self.path: Tuple[str, ...] = ()
+        if outer_state is not None:
+            self.path = outer_state.path + (sys.intern(name),)
+        self.full_name: str = sys.intern("_".join(self.path))
+        self.depth: int = len(self.path)
+        self.state_id: int = None
+        "Dense id, the top state is 0. Assigned by 'freeze()'"
+        self.state_id_last: int = None
+        "The highest 'state_id' of all substates. Assigned by 'freeze()'"
+        self.fn_state: StateType = None
+        self.fn_handle: StateType = None
+        """
+        The function called by the dispatcher: 'fn_state' or, if the state uses
+        '@hsm.on(to=...)', a function returning the declared results.
+        """
+        self.fn_entry: EntryType = None
+        self.fn_exit: ExitType = None
+        self.init_state: "HsmState" = None
+        self.substates: Dict[str, "HsmState"] = _EMPTY_SUBSTATES
+        self.plans: Dict["HsmState", _TransitionPlan] = None
+        "Cache: The state of a transition target -> _TransitionPlan"
+        self.signals: FrozenSet[SignalType] = None
+        "The signals declared by '@hsm.on()'. None if not declared."
+        self.signal_table: Dict[SignalType, Tuple["HsmState", ...]] = None
+        """
+        signal -> The states to be called for this signal, this state first.
+        None if no state of the statemachine uses '@hsm.on()'.
+        """
+        self.signal_chain_default: Tuple["HsmState", ...] = None
+        "The states to be called for a signal not in 'signal_table'"
+        self.signal_results: Dict[SignalType, Any] = None
+        "signal -> The result declared by '@hsm.on(to=...)'. None if not declared."
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if self._frozen:
+            raise AttributeError(f"State '{self.full_name}' is frozen!")
+        object.__setattr__(self, name, value)
+
+    def __repr__(self) -> str:
+        return f"HsmState({self.full_name!r})"
+
+    def freeze(self, state_id: int, state_id_last: int) -> None:
+        self.state_id = state_id
+        self.state_id_last = state_id_last
+        object.__setattr__(self, "_frozen", True)
+
+    def contains(self, state: "HsmState") -> bool:
+        """
+        Return True if 'state' is this state or one of its substates.
+        """
+        return self.state_id <= state.state_id <= self.state_id_last
+
+    def get_plan(self, state_target: "HsmState") -> _TransitionPlan:
+        """
+        Return the plan for a transition from this state to 'state_target'.
+        The plan is built on first use and then cached.
+        """
+        plans = self.plans
+        if plans is not None:
+            plan = plans.get(state_target, None)
+            if plan is not None:
+                return plan
+        else:
+            plans = {}
+            object.__setattr__(self, "plans", plans)
+        plan = _TransitionPlan.build(state_before=self, state_target=state_target)
+        plans[state_target] = plan
+        return plan
+
+    def handler_chain(self, signal: SignalType) -> Tuple["HsmState", ...]:
         """
-        Parse the docstring.
-        Lines line 'TRANSITION state_0_2_2 time > 0' will create
-        a '_Transition()' object which will be attached to both states.
+        The states whose handlers are called for this signal, this state first.
         """
-        if doc is None:
+        if self.signal_table is None:
+            return tuple(self.iter_outer_states())[:-1]
+        return self.signal_table.get(signal, self.signal_chain_default)
+
+    def compile_signal_table(self) -> None:
+        """
+        Requires the signal table of the outer state to be compiled.
+        """
+        outer_state = self.outer_state
+        if outer_state.outer_state is None:
+            # The outer state is the top state
+            outer_table: Dict[SignalType, Tuple[HsmState, ...]] = {}
+            outer_default: Tuple[HsmState, ...] = ()
+        else:
+            outer_table = outer_state.signal_table
+            outer_default = outer_state.signal_chain_default
+
+        if self.signals is None:
+            # This state handles all signals
+            self.signal_table = {
+                signal: (self,) + chain for signal, chain in outer_table.items()
+            }
+            self.signal_chain_default = (self,) + outer_default
             return
-        tag_transition = "TRANSITION "
-        tag_exit = "EXIT "
-        for line in doc.split("\n"):
-            line = line.strip()
-            # Example line: 'TRANSITION state_0_2_2 time > 0'
-            if line.startswith(tag_transition):
-                line = line[len(tag_transition) :]
-                fn_name, _, when = line.partition(" ")
-                state_to = state.hsm.find_state_by_name(fn_name=fn_name)
-                transition = _Transition(state_to=state_to, state_from=state, when=when)
-                transition.link()
-                continue
 
-            if line.startswith(tag_exit):
-                when = line[len(tag_exit) :]
-                state.exit_when = when
-                continue
+        self.signal_table = dict(outer_table)
+        for signal in self.signals:
+            self.signal_table[signal] = (self,) + outer_table.get(signal, outer_default)
+        self.signal_chain_default = outer_default
 
+    def compile_signal_results(self) -> None:
+        """
+        Resolve the targets declared by '@hsm.on(to=...)' and define 'fn_handle'.
+        """
+        fn_state = self.fn_state
+        self.fn_handle = fn_state
+        declared = getattr(fn_state, _HSM_ON_TO, None)
+        if declared is None:
+            return
 
-@dataclasses.dataclass(repr=True)
-class HsmState:
-    hsm: "HsmMixin"
-    name: str = None
-    outer_state: "HsmState" = None
-    fn_state: StateType = None
-    fn_entry: EntryType = None
-    fn_exit: ExitType = None
-    init_state: "HsmState" = None
-    substates: Dict[str, "HsmState"] = dataclasses.field(
-        default_factory=collections.OrderedDict
-    )
-    transitions_from: List[_Transition] = dataclasses.field(default_factory=list)
-    transitions_to: List[_Transition] = dataclasses.field(default_factory=list)
-    exit_when: str = None
+        results: Dict[SignalType, Any] = {}
+        for signal, to in declared.items():
+            if isinstance(to, str):
+                to = self.topology.find_state(
+                    path=HsmState.fn_name_to_path(verb=_Verb.STATE, fn_name=to),
+                    error_if_not_exists=f"'{fn_state.__name__}()': @hsm.on(to={to!r}): No such state!",
+                )
+            results[signal] = to
+        self.signal_results = results
+
+        def fn_handle(hsm_self: Any, signal: SignalType) -> Any:
+            result = results.get(signal, None)
+            if result is None:
+                return fn_state(hsm_self, signal)
+            return result
+
+        fn_handle.__name__ = fn_state.__name__
+        self.fn_handle = fn_handle
 
     def assert_consistency(self) -> None:
         assert isinstance(self.name, (type(None), str))
         assert isinstance(self.outer_state, (type(None), HsmState))
-        assert isinstance(self.fn_state, (type(None), types.MethodType))
-        assert isinstance(self.fn_entry, (type(None), types.MethodType))
-        assert isinstance(self.fn_exit, (type(None), types.MethodType))
+        for fn in (self.fn_state, self.fn_entry, self.fn_exit):
+            assert (fn is None) or _is_func_or_method(fn)
         assert isinstance(self.init_state, (type(None), HsmState))
         for substate_name, substate in self.substates.items():
             assert isinstance(substate_name, str)
             assert isinstance(substate, HsmState)
-        for transition in self.transitions_from:
-            assert isinstance(transition, _Transition)
-        for transition in self.transitions_to:
-            assert isinstance(transition, _Transition)
 
     def assert_loose_state(self) -> None:
         if self.outer_state is None:
@@ -193,25 +495,10 @@ class HsmState:
             )
 
     def resolve_init_state(self) -> "HsmState":
-        if self.init_state is None:
-            return self
-        return self.init_state.resolve_init_state()
-
-    @property
-    def full_name(self) -> str:
-        return "_".join(self.path)
-
-    @property
-    def mermaid_visible_name(self) -> str:
-        "The name including spaces"
-        if self.hsm._mermaid_detailed:
-            return f"State {self.name} ({self.full_name})"
-        return self.name
-
-    @property
-    def mermaid_tag(self) -> str:
-        "The tag referencing a state"
-        return self.full_name
+        state = self
+        while state.init_state is not None:
+            state = state.init_state
+        return state
 
     def define_init_state(self) -> None:
         if len(self.substates) == 0:
@@ -242,15 +529,19 @@ class HsmState:
         try:
             return self.substates[name]
         except KeyError:
+            if error_if_not_exists is None and self._frozen:
+                error_if_not_exists = f"State '{name}' does not exist in '{self.full_name}'!"
             if error_if_not_exists is not None:
                 raise BadStatemachineException(  # pylint: disable=raise-missing-from,broad-exception-raised
                     error_if_not_exists
                 )
             sub_state = HsmState(
-                hsm=self.hsm,
+                topology=self.topology,
                 name=name,
                 outer_state=self,
             )
+            if len(self.substates) == 0:
+                self.substates = {}
             self.substates[name] = sub_state
             return sub_state
 
@@ -265,20 +556,24 @@ class HsmState:
             return None
         return fn_name[len(verb.value) :].split("_")
 
-    @property
-    def path(self) -> List[str]:
-        if self.outer_state is None:
-            return []
-        return self.outer_state.path + [self.name]
-
     @property
     def is_init_state(self) -> bool:
         return self.outer_state.init_state is self
 
+    def iter_outer_states(self) -> Iterable["HsmState"]:
+        "This state and all its outer states up to the top state"
+        state = self
+        while state is not None:
+            yield state
+            state = state.outer_state
+
     def iter_states(self) -> Iterable["HsmState"]:
-        yield self
-        for substate in self.substates.values():
-            yield from substate.iter_states()
+        "This state and all its substates, depth first"
+        stack = [self]
+        while stack:
+            state = stack.pop()
+            yield state
+            stack.extend(reversed(state.substates.values()))
 
     def list_states(self) -> List["HsmState"]:
         """
@@ -286,72 +581,36 @@ class HsmState:
         """
         return list(self.iter_states())
 
-    def parse_transitions_from_docstring(self) -> None:
-        doc = self.fn_state.__doc__
-        _Transition.parse_docstring(state=self, doc=doc)
+    @property
+    def value(self) -> int:
+        return getattr(self.fn_state, _HSM_VALUE)
 
-    def render_mermaid(self, f) -> None:
-        def add_note(text: str) -> None:
-            f.write(f"{indent}note right of {self.mermaid_tag}\n")
-            for line in text.split("\n"):
-                f.write(f"{indent}   {line}\n")
-            f.write(f"{indent}end note\n")
 
-        def add_note_for_entry_exit(fn: StateType, tag: str):
-            if fn is None:
-                return
-            doc = fn.__doc__
-            if doc is None:
-                doc = "..."
-            add_note(f"on {tag}:\n{doc}")
-
-        def render_entry_exit() -> None:
-            if self.exit_when is not None:
-                f.write(f"{indent}{self.mermaid_tag} --> [*]: {self.exit_when}\n")
-
-            if self.hsm._mermaid_entryexit:
-                add_note_for_entry_exit(fn=self.fn_entry, tag="entry")
-                add_note_for_entry_exit(fn=self.fn_exit, tag="exit")
-
-        path = self.path
-        indent = _MERMAID_INDENT * len(path)
-        if len(self.substates) > 0:
-            if self.name is not None:
-                f.write(f"{indent}{self.mermaid_tag}: {self.mermaid_visible_name}\n")
-                f.write(f"{indent}state {self.mermaid_tag} {{\n")
-            for i, substate in zip(itertools.count(), self.substates.values()):
-                if i > 0:
-                    f.write("\n")
-                substate.render_mermaid(f=f)
-            assert (
-                self.init_state is not None
-            ), f"No init_state for substate of {self.full_name}"
-            f.write(f"{_MERMAID_INDENT}{indent}[*] --> {self.init_state.mermaid_tag}\n")
-            if self.name is not None:
-                f.write(f"{indent}}}\n")
-            render_entry_exit()
-            return
+class HsmLogEvent(enum.Flag):
+    """
+    The events a logger wants to receive.
+    The messages are only formatted if at least one logger wants them.
+    """
 
-        f.write(f"{indent}{self.mermaid_tag}: {self.mermaid_visible_name}\n")
-        f.write(f"{indent}state {self.mermaid_tag}\n")
-
-        if not self.is_init_state:
-            # Bugfix mermaid: Add at least one transistion - if not, mermaid will swallow the state
-            if len(self.transitions_from) + len(self.transitions_to) == 0:
-                f.write(f"{indent}{self.mermaid_tag} --> {self.mermaid_tag}: Dummy\n")
-        render_entry_exit()
-
-    def render_mermaid_transitions(self, f) -> None:
-        f.write(f"\n{_MERMAID_INDENT}%% Transitions\n")
-        for state in self.iter_states():
-            for transition_from in state.transitions_from:
-                f.write(
-                    f"{_MERMAID_INDENT}{state.mermaid_tag} --> {transition_from.state_to.mermaid_tag}: {transition_from.when}\n"
-                )
+    INFO = enum.auto()
+    "fn_log_info()"
+    DEBUG = enum.auto()
+    "fn_log_debug()"
+    STATE_CHANGE = enum.auto()
+    "fn_state_change()"
+    ALL = INFO | DEBUG | STATE_CHANGE
+    OUTCOME = enum.auto()
+    "fn_outcome(), not part of 'ALL': Only for loggers implementing 'HsmLoggerOutcomeProtocol'"
 
-    @property
-    def value(self) -> int:
-        return getattr(self.fn_state, _HSM_VALUE)
+
+class HsmOutcome(enum.IntEnum):
+    """
+    How a signal was processed, see 'HsmLoggerOutcomeProtocol'.
+    """
+
+    HANDLED = 1
+    IGNORED = 2
+    TRANSITION = 3
 
 
 @runtime_checkable
@@ -369,7 +628,41 @@ class HsmLoggerProtocol(Protocol):
     ) -> None: ...
 
 
+@runtime_checkable
+class HsmLoggerEventsProtocol(HsmLoggerProtocol, Protocol):
+    """
+    A logger which only wants some events.
+    A logger without 'log_events' receives all events.
+    """
+
+    log_events: HsmLogEvent
+
+
+@runtime_checkable
+class HsmLoggerOutcomeProtocol(HsmLoggerEventsProtocol, Protocol):
+    """
+    A logger with 'HsmLogEvent.OUTCOME' in 'log_events':
+    'fn_outcome()' is called for every signal processed.
+    """
+
+    def fn_outcome(
+        self,
+        signal: SignalType,
+        before: HsmState,
+        handler: HsmState,
+        target: Optional[HsmState],
+        outcome: HsmOutcome,
+        why: Optional[str],
+    ) -> None:
+        """
+        'handler' is the state whose handler returned the result.
+        'target' is the state as returned by the handler, None if the state does not change.
+        """
+
+
 class HsmStringIoLogger(HsmLoggerProtocol):
+    log_events = HsmLogEvent.ALL
+
     def __init__(self):
         self._f = io.StringIO()
 
@@ -417,22 +710,252 @@ class HsmStringIoLogger(HsmLoggerProtocol):
         return HsmStringIoLogger.strip_string(multiline_text)
 
 
+class HsmTopology:
+    """
+    The states of a statemachine class.
+    Compiled once per class by 'HsmMixin.hsm_topology()' and shared by all instances.
+    """
+
+    def __init__(self, cls: type):
+        self.cls = cls
+        self.top_state = HsmState(topology=self)
+        self.dict_fn_state: Dict[Callable, HsmState] = {}
+        self.init_state: HsmState = None
+        self.states: List[HsmState] = []
+        "All states, indexed by 'HsmState.state_id'"
+        self._diagram: Optional["hsm_diagram.HsmDiagram"] = None
+        self._compile()
+
+    def _compile(self) -> None:
+        """
+        Linear in the number of states, no recursion.
+        """
+        # One pass over all members. 'inspect.getmembers()' sorts by name:
+        # An outer state is therefore always created before its substates.
+        states_by_name: Dict[str, HsmState] = {}
+        actions: List[Tuple[_Verb, str, Callable]] = []
+        prefix_state = _Verb.STATE.value
+        for fn_name, fn in inspect.getmembers(self.cls, predicate=_is_func_or_method):
+            if fn_name.startswith(prefix_state):
+                full_name = fn_name[len(prefix_state) :]
+                outer_name, _, name = full_name.rpartition("_")
+                outer_state = self.top_state
+                if outer_name != "":
+                    outer_state = states_by_name.get(outer_name, None)
+                    if outer_state is None:
+                        # Loose state: The outer states are created without 'fn_state'
+                        outer_state = self.find_state(path=outer_name.split("_"))
+                        for state in outer_state.iter_outer_states():
+                            states_by_name.setdefault(state.full_name, state)
+                state = outer_state.find_state(name=name)
+                state.fn_state = fn
+                states_by_name[full_name] = state
+                continue
+            for verb in (_Verb.ENTRY, _Verb.EXIT):
+                if fn_name.startswith(verb.value):
+                    actions.append((verb, fn_name, fn))
+
+        states = self.top_state.list_states()
+
+        # Find loose states
+        for state in states:
+            state.assert_loose_state()
+
+        # Attach entry- and exit-actions
+        for verb, fn_name, fn in actions:
+            state = states_by_name.get(fn_name[len(verb.value) :], None)
+            if state is None:
+                raise BadStatemachineException(
+                    f"No corresponding state_Xyz() for {fn_name}()!"
+                )
+            if verb is _Verb.ENTRY:
+                state.fn_entry = fn
+            else:
+                state.fn_exit = fn
+
+        # Define init state if no substates
+        for state in states:
+            state.define_init_state()
+
+        # Signals declared by '@hsm.on()'
+        for state in states[1:]:
+            state.signals = getattr(state.fn_state, _HSM_ON, None)
+        if any(state.signals is not None for state in states[1:]):
+            # Depth first order: The outer state is compiled before its substates
+            for state in states[1:]:
+                state.compile_signal_table()
+        for state in states[1:]:
+            state.compile_signal_results()
+
+        for state in states:
+            self.dict_fn_state[state.fn_state] = state
+            state.assert_consistency()
+
+        self.init_state = self.top_state.resolve_init_state()
+        assert self.init_state is not None
+
+        # Depth first order: The substates of a state follow the state
+        self.states = states
+        dict_state_id = {state: state_id for state_id, state in enumerate(states)}
+        subtree_sizes = [1] * len(states)
+        for state_id in range(len(states) - 1, 0, -1):
+            outer_state_id = dict_state_id[states[state_id].outer_state]
+            subtree_sizes[outer_state_id] += subtree_sizes[state_id]
+        for state_id, state in enumerate(states):
+            state.freeze(
+                state_id=state_id,
+                state_id_last=state_id + subtree_sizes[state_id] - 1,
+            )
+
+    def diagram(self) -> "hsm_diagram.HsmDiagram":
+        """
+        Return the diagram. Built on first use: Only the diagram reads the docstrings.
+        """
+        # Import here: 'hsm_diagram' depends on this module
+        from hsm import hsm_diagram  # pylint: disable=import-outside-toplevel
+
+        with _LOCK_TOPOLOGY:
+            if self._diagram is None:
+                self._diagram = hsm_diagram.HsmDiagram(self)
+            return self._diagram
+
+    def find_state(self, path: List[str], error_if_not_exists: str = None) -> HsmState:
+        actual_state = self.top_state
+        for name in path:
+            actual_state = actual_state.find_state(
+                name=name, error_if_not_exists=error_if_not_exists
+            )
+        return actual_state
+
+    def find_state_by_name(self, fn_name: str) -> HsmState:
+        path = HsmState.fn_name_to_path(verb=_Verb.STATE, fn_name=fn_name)
+        return self.find_state(path=path)
+
+    def state_from_fn(self, fn: StateType) -> HsmState:
+        """
+        Return the state for a bound method like 'self.state_TopA'.
+        """
+        try:
+            # 'fn' is expected to be a bound method
+            return self.dict_fn_state[fn.__func__]  # type: ignore[attr-defined]
+        except (AttributeError, KeyError):
+            raise BadStateException(  # pylint: disable=raise-missing-from
+                f"'{fn!r}' is NOT a state of this statemachine!"
+            )
+
+    def to_state(self, fn: Union[HsmState, StateType]) -> HsmState:
+        """
+        Return the state for a handle, a bound method like 'self.state_TopA'
+        or a function like 'UnderTest.state_TopA'.
+        """
+        if isinstance(fn, HsmState):
+            assert fn.topology is self
+            return fn
+        try:
+            return self.dict_fn_state[getattr(fn, "__func__", fn)]
+        except KeyError:
+            raise BadStateException(  # pylint: disable=raise-missing-from
+                f"'{fn!r}' is NOT a state of this statemachine!"
+            )
+
+    def mask(self, *fns: Union[HsmState, StateType]) -> HsmStateMask:
+        """
+        Return the ids of the given states and all their substates.
+        """
+        state_ids: List[int] = []
+        for fn in fns:
+            state = self.to_state(fn)
+            state_ids.extend(range(state.state_id, state.state_id_last + 1))
+        return frozenset(state_ids)
+
+    def build_handles(self) -> types.SimpleNamespace:
+        """
+        Return the handles to the states: 'handles.state_TopA' is the 'HsmState' of 'state_TopA()'.
+        """
+        return types.SimpleNamespace(
+            **{
+                state.fn_state.__name__: state
+                for state in self.top_state.iter_states()
+                if state.fn_state is not None
+            }
+        )
+
+
 class HsmMixin:
+    _hsm_topology: HsmTopology
+    "Set by 'hsm_topology()' in the '__dict__' of the class which owns the topology"
+    _state_actual: HsmState = None
+    _loggers: Tuple[HsmLoggerProtocol, ...] = ()
+    _loggers_info: Tuple[HsmLoggerProtocol, ...] = ()
+    _loggers_debug: Tuple[HsmLoggerProtocol, ...] = ()
+    _loggers_state_change: Tuple[HsmLoggerProtocol, ...] = ()
+    _loggers_outcome: Tuple[HsmLoggerOutcomeProtocol, ...] = ()
+    _mailbox: Deque[SignalType] = None
+    "Signals posted by 'post()'. Created on first use."
+    _dispatching: bool = False
+    "True while a signal is processed: Further signals are queued in the mailbox"
+    hsm_states: types.SimpleNamespace = None
+    """
+    The handles to the states of this class, for example 'self.hsm_states.state_TopA'.
+    Available after 'init()'.
+    A state handler may return a handle to change the state.
+    """
+    hsm_production: bool = False
+    """
+    False (strict mode): 'dispatch()', 'is_state()' and 'call_exit_entry_actions()'
+    check the initialization and their arguments on every call.
+    True (production mode): These checks are skipped. A wrong argument may then
+    fail with a less helpful exception. The topology is checked in both modes,
+    once when it is compiled.
+    May be set per class or per instance, see '__init__()'.
+    """
+
     def __init__(
         self,
         mermaid_detailed=True,
         mermaid_entryexit=True,
         hsm_logger: HsmLoggerProtocol = None,
+        hsm_production: bool = None,
     ):
         self._mermaid_detailed = mermaid_detailed
         self._mermaid_entryexit = mermaid_entryexit
-        self._loggers: List[HsmLoggerProtocol] = []
-        self._top_state = HsmState(hsm=self)
-        self._dict_fn_state: Dict[StateType, HsmState] = {}
-        self._state_actual: HsmState = None
+        if hsm_production is not None:
+            self.hsm_production = hsm_production
         if hsm_logger is not None:
             self.add_logger(hsm_logger)
 
+    @classmethod
+    def hsm_topology(cls) -> HsmTopology:
+        """
+        Return the topology of this class.
+        The topology is compiled on first use and then shared by all instances.
+        """
+        # Look into '__dict__': A subclass must not inherit the topology of its base class
+        topology = cls.__dict__.get("_hsm_topology", None)
+        if topology is not None:
+            return topology
+        with _LOCK_TOPOLOGY:
+            topology = cls.__dict__.get("_hsm_topology", None)
+            if topology is None:
+                topology = HsmTopology(cls)
+                cls.hsm_states = topology.build_handles()
+                cls._hsm_topology = topology
+            return topology
+
+    def find_state(self, path: List[str], error_if_not_exists: str = None) -> HsmState:
+        """
+        Same as 'hsm_topology().find_state()'.
+        """
+        return self.hsm_topology().find_state(
+            path=path, error_if_not_exists=error_if_not_exists
+        )
+
+    def find_state_by_name(self, fn_name: str) -> HsmState:
+        """
+        Same as 'hsm_topology().find_state_by_name()'.
+        """
+        return self.hsm_topology().find_state_by_name(fn_name=fn_name)
+
     def get_state(self) -> HsmState:
         self.assert_initialized()
 
@@ -441,10 +964,18 @@ class HsmMixin:
     def assert_initialized(self) -> None:
         assert self._state_actual is not None, "You have to call 'init()' first!"
 
-    def assert_valid_state(self, *fns: StateType) -> None:
+    def assert_valid_state(self, *fns: Union[HsmState, StateType]) -> None:
+        topology = self._state_actual.topology
         for fn in fns:
-            if fn in self._dict_fn_state:
-                continue
+            if isinstance(fn, HsmState):
+                if fn.topology is topology:
+                    continue
+                raise BadStateException(
+                    f"State '{fn.full_name}' is NOT a state of this statemachine!"
+                )
+            if isinstance(fn, types.MethodType):
+                if (fn.__self__ is self) and (fn.__func__ in topology.dict_fn_state):
+                    continue
             try:
                 name = fn.__name__
             except AttributeError:
@@ -457,44 +988,153 @@ class HsmMixin:
                 f"State '{name}' is NOT a state of this statemachine!"
             )
 
-    def is_state(self, *fns: StateType) -> bool:
+    def is_state(self, *fns: Union[HsmState, StateType]) -> bool:
         """
         If a outer state is given, all substates are implied too!
+        The states may be given as methods 'self.state_TopA'
+        or as handles 'self.hsm_states.state_TopA'.
         """
-        self.assert_initialized()
+        if not self.hsm_production:
+            self.assert_initialized()
+            self.assert_valid_state(*fns)
 
-        self.assert_valid_state(*fns)
         state_actual = self._state_actual
-        while state_actual.fn_state is not None:
-            for fn in fns:
-                assert isinstance(fn, types.MethodType)
-                # Why does 'is' return always False?
-                if state_actual.fn_state == fn:
-                    return True
-            # Test also the outer states
-            state_actual = state_actual.outer_state
+        state_id = state_actual.state_id
+        for fn in fns:
+            # No 'cast()' or 'isinstance()': This is on the hot path
+            state: HsmState = fn  # type: ignore[assignment]
+            if state.__class__ is not HsmState:
+                state = state_actual.topology.state_from_fn(fn)  # type: ignore[arg-type]
+            if state.state_id <= state_id <= state.state_id_last:
+                return True
         return False
 
+    @classmethod
+    def hsm_mask(cls, *fns: Union[HsmState, StateType]) -> HsmStateMask:
+        """
+        Precompute a mask for 'current_state_in()'.
+        The states may be given as 'UnderTest.state_TopA' or
+        as handles 'UnderTest.hsm_states.state_TopA'.
+        """
+        return cls.hsm_topology().mask(*fns)
+
+    def current_state_in(self, mask: HsmStateMask) -> bool:
+        """
+        Same as 'is_state()' but for a mask precomputed by 'hsm_mask()'.
+        """
+        return self._state_actual.state_id in mask
+
     def force_state(self, fn: StateType) -> bool:
         self.assert_initialized()
 
         assert isinstance(fn, types.MethodType)
-        self._state_actual = self._dict_fn_state[fn]
-        self._fn_log_info(f"force_state({self._state_actual.full_name})")
+        self._state_actual = self._state_actual.topology.state_from_fn(fn)
+        if self._loggers_info:
+            self._fn_log_info(f"force_state({self._state_actual.full_name})")
+
+    def snapshot(self) -> int:
+        """
+        Return the actual state as 'state_id'.
+        The ids are stable as long as the states of the class do not change.
+        Use 'get_state().full_name' for a snapshot by name.
+        """
+        self.assert_initialized()
+
+        return self._state_actual.state_id
+
+    def restore(self, snapshot: Union[int, str], entry_actions: bool = False) -> None:
+        """
+        Set the state from 'snapshot()' or from the 'full_name' of a state.
+        'init()' is not required. The entry-actions are only called if requested.
+        """
+        topology = self.hsm_topology()
+        state = topology.top_state
+        if isinstance(snapshot, str):
+            state = topology.find_state(
+                path=snapshot.split("_"),
+                error_if_not_exists=f"State '{snapshot}' does not exist!",
+            )
+        elif 0 <= snapshot < len(topology.states):
+            state = topology.states[snapshot]
+        if state.fn_state is None:
+            raise BadStateException(f"'{snapshot}' is NOT a state of this statemachine!")
+        self._state_actual = state
+        if entry_actions:
+            self.start()
+
+    @classmethod
+    def _snapshot_typecode(cls) -> str:
+        if len(cls.hsm_topology().states) <= 0x10000:
+            return "H"
+        return "I"
+
+    @classmethod
+    def hsm_pack(cls, machines: Iterable["HsmMixin"]) -> bytes:
+        """
+        Return the 'snapshot()' of all machines packed into one buffer.
+        """
+        return array.array(
+            cls._snapshot_typecode(),
+            [machine.snapshot() for machine in machines],
+        ).tobytes()
+
+    @classmethod
+    def hsm_unpack(cls, machines: List["HsmMixin"], buffer: bytes) -> None:
+        """
+        Restore the machines from a buffer returned by 'hsm_pack()'.
+        The entry-actions are not called.
+        No machine is changed if the buffer contains an invalid state.
+        """
+        snapshots = array.array(cls._snapshot_typecode())
+        snapshots.frombytes(buffer)
+        if len(snapshots) != len(machines):
+            raise ValueError(
+                f"The buffer contains {len(snapshots)} states but got {len(machines)} machines!"
+            )
+        states = cls.hsm_topology().states
+        # Same check as 'restore()': Not the top state, not a loose outer state
+        for state_id in set(snapshots):
+            if (state_id >= len(states)) or (states[state_id].fn_state is None):
+                raise BadStatemachineException(
+                    f"The buffer contains the state id {state_id} which is NOT a state of this statemachine!"
+                )
+        for machine, state_id in zip(machines, snapshots):
+            machine._state_actual = states[state_id]
 
     def add_logger(self, hsm_logger: HsmLoggerProtocol):
         """
         Append a logger
         """
         assert isinstance(hsm_logger, HsmLoggerProtocol)
-        self._loggers.append(hsm_logger)
+        self._set_loggers(self._loggers + (hsm_logger,))
+
+    def remove_logger(self, hsm_logger: HsmLoggerProtocol):
+        """
+        Remove a logger
+        """
+        self._set_loggers(tuple(l for l in self._loggers if l is not hsm_logger))
+
+    def _set_loggers(self, loggers: Tuple[HsmLoggerProtocol, ...]) -> None:
+        def wanting(event: HsmLogEvent) -> Tuple[HsmLoggerProtocol, ...]:
+            return tuple(
+                l for l in loggers if event in getattr(l, "log_events", HsmLogEvent.ALL)
+            )
+
+        self._loggers = loggers
+        self._loggers_info = wanting(HsmLogEvent.INFO)
+        self._loggers_debug = wanting(HsmLogEvent.DEBUG)
+        self._loggers_state_change = wanting(HsmLogEvent.STATE_CHANGE)
+        # A logger asking for 'OUTCOME' implements 'fn_outcome()'
+        self._loggers_outcome = cast(
+            Tuple[HsmLoggerOutcomeProtocol, ...], wanting(HsmLogEvent.OUTCOME)
+        )
 
     def _fn_log_info(self, msg: str) -> None:
-        for l in self._loggers:
+        for l in self._loggers_info:
             l.fn_log_info(msg)
 
     def _fn_log_debug(self, msg: str) -> None:
-        for l in self._loggers:
+        for l in self._loggers_debug:
             l.fn_log_debug(msg)
 
     def _fn_state_change(
@@ -504,172 +1144,290 @@ class HsmMixin:
         why: str,
         list_entry_exit: List[str],
     ) -> None:
-        for l in self._loggers:
+        for l in self._loggers_state_change:
             l.fn_state_change(before, after, why, list_entry_exit)
 
-    def dispatch(self, signal: SignalType):
+    def _fn_outcome(
+        self,
+        signal: SignalType,
+        before: HsmState,
+        handler: HsmState,
+        target: Optional[HsmState],
+        outcome: HsmOutcome,
+        why: Optional[str],
+    ) -> None:
+        for l in self._loggers_outcome:
+            l.fn_outcome(signal, before, handler, target, outcome, why)
+
+    def post(self, signal: SignalType) -> None:
+        """
+        Queue a signal.
+        It will be processed by 'drain()', or, if a signal is processed right now,
+        after this signal has been completed (run-to-completion).
+        """
+        mailbox = self._mailbox
+        if mailbox is None:
+            mailbox = self._mailbox = collections.deque()
+        mailbox.append(signal)
+
+    def drain(self) -> int:
+        """
+        Dispatch all posted signals, including the signals posted meanwhile.
+        Return the number of signals dispatched.
+        """
         self.assert_initialized()
 
-        state_before = self._state_actual
-        why = None
+        if self._dispatching or not self._mailbox:
+            return 0
+        self._dispatching = True
+        try:
+            return self._drain_mailbox()
+        finally:
+            self._dispatching = False
+
+    def _drain_mailbox(self) -> int:
+        mailbox = self._mailbox
+        count = 0
+        while mailbox:
+            self._dispatch(mailbox.popleft())
+            count += 1
+        return count
+
+    def dispatch(self, signal: SignalType):
+        """
+        Process the signal and then all signals posted meanwhile.
+
+        If called while a signal is processed - for example from a state handler
+        or an entry/exit-action - the signal is just posted and will be processed
+        after the actual signal has been completed (run-to-completion).
+
+        The signals are processed in order (FIFO): Signals posted before
+        and not drained yet are processed before this signal.
 
+        If a state handler or an action raises, the signals not processed yet
+        stay posted, including the signals posted by the failing step:
+        They are processed by the next 'drain()' or 'dispatch()'.
+        """
+        if not self.hsm_production:
+            self.assert_initialized()
+
+        if self._dispatching:
+            self.post(signal)
+            return
+        self._dispatching = True
         try:
-            self._fn_log_info(
-                f"{signal!r}: will be handled by {self._state_actual.full_name}"
-            )
-            self._fn_log_debug(
-                f'  calling state "state_{state_before.full_name}({signal})"'
-            )
-            handling_state = self._state_actual
-            while True:
-                handling_state.fn_state(signal)
-                err = f"Signal {signal} was not handled by state_{handling_state.full_name}!"
-                handling_state = handling_state.outer_state
-                if (handling_state is None) or (handling_state.fn_state is None):
-                    raise Exception(err)  # pylint: disable=broad-exception-raised
+            mailbox = self._mailbox
+            if mailbox:
+                mailbox.append(signal)
+            else:
+                self._dispatch(signal)
+            if self._mailbox:
+                self._drain_mailbox()
+        finally:
+            self._dispatching = False
+
+    def _dispatch(
+        self, signal: SignalType, chain: Optional[Tuple[HsmState, ...]] = None
+    ):
+        """
+        The state handlers are called starting with the actual state and then
+        bubbling up to the outer states till a state handler returns not None:
+
+        * 'HANDLED': No state change.
+        * 'IGNORED' or 'Ignore(why)': Empty transition.
+        * 'Transition(target, why)', a handle 'self.hsm_states.state_Xyz'
+          or a method 'self.state_Xyz': Change the state.
 
+        The exceptions 'DontChangeStateException', 'IgnoreEventException' and
+        'StateChangeException' are supported too.
+
+        'chain': The state handlers to call, if already resolved by the caller,
+        see 'HsmState.handler_chain()'.
+        """
+        state_before = self._state_actual
+        if self._loggers:
+            self._log_dispatch(signal=signal, state=state_before)
+
+        handling_state = state_before
+        signal_table = state_before.signal_table
+        result: StateResult
+        try:
+            if (chain is None) and (signal_table is None):
+                while True:
+                    result = handling_state.fn_handle(self, signal)
+                    if result is not None:
+                        break
+                    outer_state = handling_state.outer_state
+                    if (outer_state is None) or (outer_state.fn_state is None):
+                        raise _not_handled(signal=signal, state=handling_state)
+                    handling_state = outer_state
+            else:
+                if chain is None:
+                    # Only call the states which declared this signal by '@hsm.on()'
+                    chain = signal_table.get(signal, state_before.signal_chain_default)
+                for handling_state in chain:
+                    result = handling_state.fn_handle(self, signal)
+                    if result is not None:
+                        break
+                else:
+                    raise _not_handled(signal=signal, state=handling_state)
         except DontChangeStateException:
-            self._fn_log_debug("  No state change!")
-            return
+            result = HANDLED
         except IgnoreEventException as e:
-            why = e.why
-            why_text = ""
-            if why is not None:
-                why_text = f" ({why})"
-            self._fn_log_debug(f"  Empty Transition!{why_text}")
-            return
+            if not self.hsm_production:
+                e.assert_valid()
+            result = Ignore(why=e.why)
         except StateChangeException as e:
-            why = e.why
-            self._fn_log_debug(
-                f"{signal}: was handled by state_{handling_state.full_name}"
-            )
-            # Evaluate init-state
-            new_state = self._dict_fn_state[e.fn_new_state]
-            state_after = new_state.resolve_init_state()
-            if state_after is not new_state:
-                self._fn_log_debug(
-                    f"  Init-State for {new_state.full_name} is {state_after.full_name}."
-                )
-            self._state_actual = state_after
+            if not self.hsm_production:
+                e.assert_valid()
+            result = Transition(target=e.fn_new_state, why=e.why)
 
-        # Call the exit/entry-actions
-        list_entry_exit = self.call_exit_entry_actions(
+        plan = self._process_result(
             signal=signal,
             state_before=state_before,
-            state_after=state_after,
+            handling_state=handling_state,
+            result=result,
         )
+        if plan is None:
+            return
 
-        self._fn_state_change(state_before, state_after, why, list_entry_exit)
-
-    def call_exit_entry_actions(
-        self,
-        signal: SignalType,
-        state_before: HsmState,
-        state_after,
-    ) -> List[str]:
-        assert isinstance(state_before, HsmState)
-        assert isinstance(state_after, HsmState)
-
-        list_entry_exit: List[str] = []
-
-        def find_common_path() -> List[str]:
-            path_before = state_before.path
-            path_after = state_after.path
-            path_common: List[str] = []
-            for i in range(min(len(path_before), len(path_after))):
-                if path_before[i] != path_after[i]:
-                    return path_common
-                path_common.append(path_before[i])
-            return path_common
-
-        path_common = find_common_path()
-
-        toppest_state = self.find_state(path=path_common)
-
-        # Call Exit-Actions
-        while state_before is not toppest_state:
-            if state_before.fn_exit is not None:
-                self._fn_log_debug(f"  Calling {state_before.fn_exit.__name__}")
-                list_entry_exit.append(state_before.fn_exit.__name__)
-                state_before.fn_exit(signal)
-            state_before = state_before.outer_state
-
-        # Call all Entry-Actions
-        def recurse_entry_actions(state: HsmState) -> None:
-            if state is toppest_state:
-                return
-            recurse_entry_actions(state=state.outer_state)
-            if state.fn_entry is not None:
-                self._fn_log_debug(f"  Calling {state.fn_entry.__name__}")
-                list_entry_exit.append(state.fn_entry.__name__)
-                state.fn_entry(signal)
-
-        recurse_entry_actions(state_after)
-
-        return list_entry_exit
-
-    def find_state(self, path: List[str], error_if_not_exists: str = None) -> HsmState:
-        actual_state = self._top_state
-        for name in path:
-            actual_state = actual_state.find_state(
-                name=name, error_if_not_exists=error_if_not_exists
-            )
-        return actual_state
-
-    def find_state_by_name(self, fn_name: str) -> HsmState:
-        path = HsmState.fn_name_to_path(verb=_Verb.STATE, fn_name=fn_name)
-        return self.find_state(path=path)
+        # Call the exit/entry-actions
+        self._call_plan(signal=signal, plan=plan)
 
-    def init(self):
-        def iter_member(verb: _Verb):
-            assert isinstance(verb, _Verb)
-            for fn_name, method in inspect.getmembers(self, predicate=inspect.ismethod):
-                path = HsmState.fn_name_to_path(verb=verb, fn_name=fn_name)
-                if path is None:
-                    continue
-                yield fn_name, path, method
+        if self._loggers_state_change:
+            self._log_state_change(state_before=state_before, plan=plan, result=result)
 
-        # Initialize all states
-        for fn_name, path, fn_state in iter_member(_Verb.STATE):
-            state = self.find_state(path=path)
-            state.fn_state = fn_state
+    def _log_dispatch(self, signal: SignalType, state: HsmState) -> None:
+        # The log messages are only formatted if a logger wants them
+        if self._loggers_info:
+            self._fn_log_info(f"{signal!r}: will be handled by {state.full_name}")
+        if self._loggers_debug:
+            self._fn_log_debug(f'  calling state "state_{state.full_name}({signal})"')
 
-        # Find loose states
-        for state in self._top_state.iter_states():
-            state.assert_loose_state()
+    def _log_state_change(
+        self, state_before: HsmState, plan: _TransitionPlan, result: Any
+    ) -> None:
+        why = result.why if result.__class__ is Transition else None
+        # A fresh list: The plan is shared by all instances of the class
+        self._fn_state_change(state_before, plan.state_after, why, list(plan.names))
 
-        # Attach entry-actions
-        for fn_name, path, fn_state in iter_member(_Verb.ENTRY):
-            state = self.find_state(
-                path=path,
-                error_if_not_exists=f"No corresponding state_Xyz() for {fn_name}()!",
+    def _process_result(
+        self,
+        signal: SignalType,
+        state_before: HsmState,
+        handling_state: HsmState,
+        result: StateResult,
+    ) -> Optional[_TransitionPlan]:
+        """
+        Evaluate the value returned by the state handler.
+        Return None if the state does not change.
+        Return the plan if the state changes: The new state is already set,
+        but the exit/entry-actions are not called yet.
+        """
+        log_debug = self._loggers_debug
+
+        if result is HANDLED:
+            if log_debug:
+                self._fn_log_debug("  No state change!")
+            if self._loggers_outcome:
+                self._fn_outcome(
+                    signal,
+                    state_before,
+                    handling_state,
+                    None,
+                    HsmOutcome.HANDLED,
+                    None,
+                )
+            return None
+        result_class = result.__class__
+        if result_class is Ignore:
+            why = cast(Ignore, result).why
+            if log_debug:
+                why_text = ""
+                if why is not None:
+                    why_text = f" ({why})"
+                self._fn_log_debug(f"  Empty Transition!{why_text}")
+            if self._loggers_outcome:
+                self._fn_outcome(
+                    signal,
+                    state_before,
+                    handling_state,
+                    None,
+                    HsmOutcome.IGNORED,
+                    why,
+                )
+            return None
+        why = None
+        target = cast(Union[HsmState, StateType], result)
+        if result_class is Transition:
+            transition = cast(Transition, result)
+            why = transition.why
+            target = transition.target
+        if target.__class__ is HsmState:
+            new_state = cast(HsmState, target)
+            if not self.hsm_production:
+                assert (
+                    new_state.topology is state_before.topology
+                ), f"State '{new_state.full_name}' is NOT a state of this statemachine!"
+        else:
+            new_state = state_before.topology.state_from_fn(cast(StateType, target))
+        if self._loggers_outcome:
+            self._fn_outcome(
+                signal,
+                state_before,
+                handling_state,
+                new_state,
+                HsmOutcome.TRANSITION,
+                why,
             )
-            state.fn_entry = fn_state
 
-        # Attach exit-actions
-        for fn_name, path, fn_state in iter_member(_Verb.EXIT):
-            state = self.find_state(
-                path=path,
-                error_if_not_exists=f"No corresponding state_Xyz() for {fn_name}()!",
+        plan = state_before.get_plan(new_state)
+        self._state_actual = plan.state_after
+        if log_debug:
+            self._fn_log_debug(
+                f"{signal}: was handled by state_{handling_state.full_name}"
             )
-            state.fn_exit = fn_state
+            if plan.state_after is not new_state:
+                self._fn_log_debug(
+                    f"  Init-State for {new_state.full_name} is {plan.state_after.full_name}."
+                )
+        return plan
 
-        # Define init state if no substates
-        for state in self._top_state.list_states():
-            state.define_init_state()
+    def _call_plan(self, signal: SignalType, plan: _TransitionPlan) -> None:
+        if self._loggers_debug:
+            for fn, name in zip(plan.actions, plan.names):
+                self._fn_log_debug(f"  Calling {name}")
+                fn(self, signal)
+            return
 
-        # Read transitions from docstrings
-        for state in self._top_state.list_states():
-            state.parse_transitions_from_docstring()
+        for fn in plan.actions:
+            fn(self, signal)
 
-        for state in self._top_state.list_states():
-            self._dict_fn_state[state.fn_state] = state
+    def call_exit_entry_actions(
+        self,
+        signal: SignalType,
+        state_before: HsmState,
+        state_after,
+    ) -> List[str]:
+        """
+        Call the exit-actions from 'state_before' and the entry-actions
+        down to the init-state of 'state_after'.
+        """
+        if not self.hsm_production:
+            assert isinstance(state_before, HsmState)
+            assert isinstance(state_after, HsmState)
 
-        for state in self._top_state.list_states():
-            state.assert_consistency()
+        plan = state_before.get_plan(state_after)
+        self._call_plan(signal=signal, plan=plan)
+        return list(plan.names)
 
-        self._state_actual = self._top_state.resolve_init_state()
-        assert self._state_actual is not None
+    def init(self):
+        """
+        Set the statemachine into its init state.
+        The topology is compiled on the first call for this class, all
+        further calls just reuse it.
+        """
+        self._state_actual = self.hsm_topology().init_state
 
         # TODO
         # self.start()
@@ -678,15 +1436,38 @@ class HsmMixin:
         self.assert_initialized()
 
         # Call the entry-actions
-        self.call_exit_entry_actions(
-            signal=None, state_before=self._top_state, state_after=self._state_actual
-        )
+        assert not self._dispatching
+        self._dispatching = True
+        try:
+            self.call_exit_entry_actions(
+                signal=None,
+                state_before=self._state_actual.topology.top_state,
+                state_after=self._state_actual,
+            )
+            self._drain_mailbox()
+        finally:
+            self._dispatching = False
 
     def write_mermaid_md(self, filename: pathlib.Path) -> None:
+        self.write_diagram(filename=filename, fmt="mermaid")
+
+    def render_diagram(self, fmt: str = "mermaid", highlight_current: bool = False) -> str:
+        """
+        Return the diagram in the format 'fmt', see 'hsm_diagram.FORMATS'.
+        The static part is rendered once per class and options.
+        If 'highlight_current': The actual state is highlighted.
+        """
+        return self.hsm_topology().diagram().render(
+            fmt=fmt,
+            mermaid_detailed=self._mermaid_detailed,
+            mermaid_entryexit=self._mermaid_entryexit,
+            current=self._state_actual if highlight_current else None,
+        )
+
+    def write_diagram(
+        self, filename: pathlib.Path, fmt: str = "mermaid", highlight_current: bool = False
+    ) -> None:
         assert isinstance(filename, pathlib.Path)
-        with filename.open("w") as f:
-            f.write("```mermaid\n")
-            f.write("stateDiagram-v2\n")
-            self._top_state.render_mermaid(f=f)
-            self._top_state.render_mermaid_transitions(f=f)
-            f.write("```\n")
+        filename.write_text(
+            self.render_diagram(fmt=fmt, highlight_current=highlight_current)
+        )
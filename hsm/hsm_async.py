@@ -0,0 +1,279 @@
+import asyncio
+import types
+from typing import Any, Callable, List, Tuple, Union
+
+from hsm.hsm import (
+    HANDLED,
+    DontChangeStateException,
+    HsmMixin,
+    HsmState,
+    Ignore,
+    IgnoreEventException,
+    SignalType,
+    StateChangeException,
+    StateResult,
+    Transition,
+    _not_handled,
+    _TransitionPlan,
+)
+
+
+class AsyncHsmMixin(HsmMixin):
+    """
+    A statemachine for asyncio.
+
+    The states, entry- and exit-actions are found the same way as for 'HsmMixin'.
+    They may be coroutines ('async def') or plain functions: Plain functions
+    are called without awaiting anything.
+
+    Signals are processed by 'await dispatch(signal)' or posted by 'post(signal)'.
+    The posted signals are processed by 'await drain()' or by the mailbox task
+    started by 'start_mailbox()'.
+    While the mailbox task is running, all signals have to be posted.
+    An exception raised while the mailbox task processes a signal does not stop
+    the task: It is passed to the 'on_error' callback of 'start_mailbox()'.
+    """
+
+    _queue: "asyncio.Queue[SignalType]" = None
+    "The mailbox. Created on first use."
+    _mailbox_task: "asyncio.Task[None]" = None
+    _mailbox_on_error: Callable[[SignalType, Exception], None] = None
+    mailbox_errors: List[Tuple[SignalType, Exception]] = None
+    "(signal, exception) raised in the mailbox task, if 'start_mailbox()' got no 'on_error'"
+
+    def post(self, signal: SignalType) -> None:
+        """
+        Queue a signal, does not block.
+        """
+        queue = self._queue
+        if queue is None:
+            queue = self._queue = asyncio.Queue()
+        queue.put_nowait(signal)
+
+    def _has_posted(self) -> bool:
+        return (self._queue is not None) and not self._queue.empty()
+
+    async def drain(self) -> int:  # type: ignore[override]
+        """
+        Dispatch all posted signals, including the signals posted meanwhile.
+        Return the number of signals dispatched.
+        """
+        self.assert_initialized()
+
+        if self._dispatching or not self._has_posted():
+            return 0
+        self._dispatching = True
+        try:
+            return await self._drain_mailbox()
+        finally:
+            self._dispatching = False
+
+    async def _drain_mailbox(self) -> int:  # type: ignore[override]
+        queue = self._queue
+        count = 0
+        while not queue.empty():
+            try:
+                await self._dispatch(queue.get_nowait())
+            finally:
+                queue.task_done()
+            count += 1
+        return count
+
+    async def dispatch(self, signal: SignalType) -> None:  # type: ignore[override]
+        """
+        Process the signal and then all signals posted meanwhile.
+
+        If called while a signal is processed, the signal is just posted
+        and will be processed after the actual signal has been completed.
+
+        The signals are processed in order (FIFO): Signals posted before
+        and not drained yet are processed before this signal.
+
+        If a state handler or an action raises, the signals not processed yet
+        stay posted, including the signals posted by the failing step:
+        They are processed by the next 'drain()' or 'dispatch()'.
+        """
+        if not self.hsm_production:
+            self.assert_initialized()
+
+        if self._dispatching:
+            self.post(signal)
+            return
+        assert (self._mailbox_task is None) or (
+            self._mailbox_task is asyncio.current_task()
+        ), "The mailbox task is running: Use 'post()'!"
+        self._dispatching = True
+        try:
+            if self._has_posted():
+                self.post(signal)
+            else:
+                await self._dispatch(signal)
+            if self._has_posted():
+                await self._drain_mailbox()
+        finally:
+            self._dispatching = False
+
+    async def _dispatch(self, signal: SignalType) -> None:  # type: ignore[override]
+        state_before = self._state_actual
+        if self._loggers:
+            self._log_dispatch(signal=signal, state=state_before)
+
+        handling_state = state_before
+        result: StateResult
+        try:
+            for handling_state in state_before.handler_chain(signal):
+                result = handling_state.fn_handle(self, signal)
+                if result.__class__ is types.CoroutineType:
+                    result = await result
+                if result is not None:
+                    break
+            else:
+                raise _not_handled(signal=signal, state=handling_state)
+        except DontChangeStateException:
+            result = HANDLED
+        except IgnoreEventException as e:
+            if not self.hsm_production:
+                e.assert_valid()
+            result = Ignore(why=e.why)
+        except StateChangeException as e:
+            if not self.hsm_production:
+                e.assert_valid()
+            result = Transition(target=e.fn_new_state, why=e.why)
+
+        plan = self._process_result(
+            signal=signal,
+            state_before=state_before,
+            handling_state=handling_state,
+            result=result,
+        )
+        if plan is None:
+            return
+
+        # Call the exit/entry-actions
+        await self._call_plan(signal=signal, plan=plan)
+
+        if self._loggers_state_change:
+            self._log_state_change(state_before=state_before, plan=plan, result=result)
+
+    async def _call_plan(  # type: ignore[override]
+        self, signal: SignalType, plan: _TransitionPlan
+    ) -> None:
+        log_debug = self._loggers_debug
+        for fn, name in zip(plan.actions, plan.names):
+            if log_debug:
+                self._fn_log_debug(f"  Calling {name}")
+            result = fn(self, signal)
+            if result.__class__ is types.CoroutineType:
+                await result
+
+    async def call_exit_entry_actions(  # type: ignore[override]
+        self,
+        signal: SignalType,
+        state_before: HsmState,
+        state_after: HsmState,
+    ) -> Any:
+        plan = state_before.get_plan(state_after)
+        await self._call_plan(signal=signal, plan=plan)
+        return list(plan.names)
+
+    def restore(self, snapshot: Union[int, str], entry_actions: bool = False) -> None:
+        """
+        Same as 'HsmMixin.restore()', but without entry-actions:
+        Use 'await start()' after 'restore()' to call them.
+        """
+        assert (
+            not entry_actions
+        ), "The entry-actions have to be awaited: Use 'await start()' after 'restore()'!"
+        super().restore(snapshot)
+
+    async def start(self) -> None:  # type: ignore[override]
+        """
+        Call the entry-actions of the init state.
+        """
+        self.assert_initialized()
+
+        assert not self._dispatching
+        self._dispatching = True
+        try:
+            await self.call_exit_entry_actions(
+                signal=None,
+                state_before=self._state_actual.topology.top_state,
+                state_after=self._state_actual,
+            )
+            if self._has_posted():
+                await self._drain_mailbox()
+        finally:
+            self._dispatching = False
+
+    def start_mailbox(
+        self, on_error: Callable[[SignalType, Exception], None] = None
+    ) -> "asyncio.Task[None]":
+        """
+        Start a task which processes the posted signals.
+        'on_error(signal, exception)' is called if dispatching a signal raises,
+        by default the error is appended to 'mailbox_errors'.
+        """
+        self.assert_initialized()
+        assert self._mailbox_task is None, "The mailbox task is already running!"
+
+        if on_error is None:
+            if self.mailbox_errors is None:
+                self.mailbox_errors = []
+            on_error = self._add_mailbox_error
+        self._mailbox_on_error = on_error
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._mailbox_task = asyncio.get_running_loop().create_task(
+            self._run_mailbox()
+        )
+        return self._mailbox_task
+
+    def _add_mailbox_error(self, signal: SignalType, e: Exception) -> None:
+        self.mailbox_errors.append((signal, e))
+
+    async def _run_mailbox(self) -> None:
+        queue = self._queue
+        while True:
+            signal = await queue.get()
+            # One signal at a time: An error is reported for the signal causing it
+            self._dispatching = True
+            try:
+                await self._dispatch(signal)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._mailbox_on_error(signal, e)
+            finally:
+                self._dispatching = False
+                queue.task_done()
+
+    async def join(self) -> None:
+        """
+        Wait till all posted signals have been processed by the mailbox task.
+        Raise if the mailbox task is not running but signals are waiting.
+        """
+        queue = self._queue
+        if queue is None:
+            return
+        task = self._mailbox_task
+        if task is None or task.done():
+            if queue.empty():
+                return
+            raise RuntimeError("The mailbox task is not running: Use 'drain()'!")
+        joined = asyncio.ensure_future(queue.join())
+        await asyncio.wait((joined, task), return_when=asyncio.FIRST_COMPLETED)
+        if not joined.done():
+            joined.cancel()
+            raise RuntimeError("The mailbox task stopped before the mailbox was empty!")
+
+    async def stop_mailbox(self) -> None:
+        """
+        Stop the mailbox task. Signals not processed yet remain in the mailbox.
+        """
+        task = self._mailbox_task
+        if task is None:
+            return
+        self._mailbox_task = None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,447 @@
+"""
+Compile a statemachine class into a Python module with a specialized dispatcher.
+
+    python -m hsm.hsm_codegen my_module:MyStatemachine my_module_dispatch.py
+
+The generated module contains one dispatch function per leaf state: The
+bubbling chain, the init-state resolution and the exit/entry-actions are
+unrolled into straight-line calls. The module defines 'dispatch(self, signal)'
+which behaves like 'HsmMixin.dispatch()':
+
+    import my_module_dispatch
+    my_module_dispatch.dispatch(sm, signal)
+
+or, for all instances of the class:
+
+    MyStatemachine.dispatch = my_module_dispatch.dispatch
+
+The generated module checks on import that the topology did not change.
+Use 'verify()' to compare the generated dispatcher with 'HsmMixin.dispatch()'.
+"""
+
+import argparse
+import importlib
+import pathlib
+import random
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from hsm.hsm import (
+    BadStatemachineException,
+    HsmMixin,
+    HsmState,
+    HsmTopology,
+    SignalType,
+    _Verb,
+)
+
+_INDENT = "    "
+
+
+def topology_signature(topology: HsmTopology) -> Tuple[Tuple[Any, ...], ...]:
+    """
+    What the generated code relies on, per state: The name, if there are
+    entry/exit-actions, if the signals are declared by '@hsm.on()', the init-state,
+    the declared signals and the results declared by '@hsm.on(to=...)'.
+    The signals are given by 'repr()'.
+    """
+
+    def declared_result(result: Any) -> Any:
+        if result.__class__ is HsmState:
+            return result.state_id
+        return repr(result)
+
+    signature = []
+    for state in topology.states:
+        signals = None
+        if state.signals is not None:
+            signals = tuple(sorted(repr(signal) for signal in state.signals))
+        results = None
+        if state.signal_results is not None:
+            results = tuple(
+                sorted(
+                    (repr(signal), declared_result(result))
+                    for signal, result in state.signal_results.items()
+                )
+            )
+        signature.append(
+            (
+                state.full_name,
+                state.fn_entry is not None,
+                state.fn_exit is not None,
+                state.signal_table is not None,
+                None if state.init_state is None else state.init_state.state_id,
+                signals,
+                results,
+            )
+        )
+    return tuple(signature)
+
+
+def _candidate_targets(state: HsmState, states_by_fn_name: Dict[str, HsmState]) -> List[HsmState]:
+    """
+    The targets a state handler may return: The targets declared by
+    '@hsm.on(to=...)' and the states referenced like 'self.state_Xyz' or
+    'self.hsm_states.state_Xyz' in the code of the handler.
+    Other targets are still supported, but not unrolled.
+    """
+    targets: List[HsmState] = []
+    if state.signal_results is not None:
+        targets.extend(
+            result for result in state.signal_results.values() if result.__class__ is HsmState
+        )
+    code = getattr(state.fn_state, "__code__", None)
+    if code is not None:
+        for name in code.co_names:
+            if name.startswith(_Verb.STATE.value) and name in states_by_fn_name:
+                targets.append(states_by_fn_name[name])
+    return targets
+
+
+class _Generator:
+    def __init__(self, cls: type):
+        assert issubclass(cls, HsmMixin)
+        if "." in cls.__qualname__ or cls.__module__ == "__main__":
+            raise BadStatemachineException(
+                f"'{cls.__qualname__}': Only classes defined at module level may be compiled!"
+            )
+        self.cls = cls
+        self.topology: HsmTopology = cls.hsm_topology()
+        self.lines: List[str] = []
+        self.transition_lines: List[str] = []
+        self.names: Dict[str, str] = {}
+        "Name in the generated module -> expression binding it"
+        self.transitions: Dict[Tuple[int, Tuple[str, ...]], str] = {}
+        "(state_id after, names of the actions) -> name of the transition function"
+        self.states_by_fn_name = {
+            state.fn_state.__name__: state
+            for state in self.topology.states
+            if state.fn_state is not None
+        }
+        self.action_names: Dict[Callable, str] = {}
+        for state in self.topology.states:
+            if state.fn_exit is not None:
+                self.action_names[state.fn_exit] = f"_x{state.state_id}"
+            if state.fn_entry is not None:
+                self.action_names[state.fn_entry] = f"_n{state.state_id}"
+
+    def emit(self, line: str = "", indent: int = 0) -> None:
+        self.lines.append(f"{_INDENT * indent}{line}" if line else "")
+
+    def bind_state(self, state: HsmState) -> str:
+        name = f"_S{state.state_id}"
+        self.names[name] = f"_STATES[{state.state_id}]"
+        return name
+
+    def bind_handler(self, state: HsmState) -> str:
+        name = f"_h{state.state_id}"
+        self.names[name] = f"{self.bind_state(state)}.fn_handle"
+        return name
+
+    def bind_action(self, fn: Callable) -> str:
+        name = self.action_names[fn]
+        state_id = int(name[2:])
+        attribute = "fn_exit" if name.startswith("_x") else "fn_entry"
+        self.names[name] = f"{self.bind_state(self.topology.states[state_id])}.{attribute}"
+        return name
+
+    def transition(self, state: HsmState, target: HsmState) -> str:
+        """
+        Return the name of the function changing the state and calling the exit/entry-actions.
+        """
+        plan = state.get_plan(target)
+        actions = tuple(self.bind_action(fn) for fn in plan.actions)
+        key = (plan.state_after.state_id, actions)
+        name = self.transitions.get(key, None)
+        if name is not None:
+            return name
+        name = self.transitions[key] = f"_t{len(self.transitions)}"
+        self.transition_lines.append(f"def {name}(self, signal):")
+        self.transition_lines.append(
+            f"{_INDENT}self._state_actual = {self.bind_state(plan.state_after)}"
+        )
+        for action in actions:
+            self.transition_lines.append(f"{_INDENT}{action}(self, signal)")
+        self.transition_lines.extend(("", ""))
+        return name
+
+    def emit_chain(self, chain: Sequence[HsmState], state_not_handled: HsmState, indent: int) -> None:
+        """
+        Call the handlers of 'chain' till one returns not None.
+        """
+        if len(chain) == 0:
+            self.emit(
+                f"raise _not_handled(signal=signal, state={self.bind_state(state_not_handled)})",
+                indent,
+            )
+            return
+        for i, handling_state in enumerate(chain):
+            if i == 0:
+                self.emit(f"result = {self.bind_handler(handling_state)}(self, signal)", indent)
+                continue
+            self.emit("if result is None:", indent)
+            self.emit(f"result = {self.bind_handler(handling_state)}(self, signal)", indent + 1)
+        self.emit("if result is None:", indent)
+        self.emit(
+            f"raise _not_handled(signal=signal, state={self.bind_state(state_not_handled)})",
+            indent + 1,
+        )
+
+    def emit_leaf(self, state: HsmState) -> str:
+        name = f"_dispatch_{state.full_name}"
+        chains: Dict[Tuple[HsmState, ...], str] = {}
+        if state.signal_table is not None:
+            # The chain depends on the signal: One function per chain
+            for chain in (state.signal_chain_default, *state.signal_table.values()):
+                if chain in chains:
+                    continue
+                chain_name = chains[chain] = f"{name}__chain{len(chains)}"
+                self.emit(f"def {chain_name}(self, signal):")
+                self.emit_chain(
+                    chain, state_not_handled=chain[-1] if chain else state, indent=1
+                )
+                if chain:
+                    self.emit("return result", 1)
+                self.emit()
+                self.emit()
+            # The signals are not written to the module: They are taken from the topology
+            self.emit(f"{name}__chains_by_id = {{")
+            for chain, chain_name in chains.items():
+                self.emit(f"{tuple(s.state_id for s in chain)!r}: {chain_name},", 1)
+            self.emit("}")
+            self.emit(f"{name}__chains = {{")
+            self.emit(
+                f"signal: {name}__chains_by_id[tuple(s.state_id for s in chain)]", 1
+            )
+            self.emit(f"for signal, chain in {self.bind_state(state)}.signal_table.items()", 1)
+            self.emit("}")
+            self.emit()
+            self.emit()
+
+        targets: Dict[HsmState, str] = {}
+        for handling_state in state.iter_outer_states():
+            if handling_state.fn_state is None:
+                continue
+            for target in _candidate_targets(handling_state, self.states_by_fn_name):
+                if target not in targets:
+                    targets[target] = self.transition(state, target)
+        self.emit(
+            f"{name}__transitions = {{"
+            + ", ".join(
+                f"{self.bind_state(target)}: {fn_name}" for target, fn_name in targets.items()
+            )
+            + "}"
+        )
+        self.emit()
+        self.emit()
+
+        self.emit(f"def {name}(self, signal):")
+        self.emit("try:", 1)
+        if state.signal_table is None:
+            chain = tuple(state.iter_outer_states())[:-1]
+            self.emit_chain(chain, state_not_handled=chain[-1], indent=2)
+        else:
+            self.emit(
+                f"result = {name}__chains.get(signal, {chains[state.signal_chain_default]})(self, signal)",
+                2,
+            )
+        self.emit("except DontChangeStateException:", 1)
+        self.emit("return", 2)
+        self.emit("except IgnoreEventException as e:", 1)
+        self.emit("if not self.hsm_production:", 2)
+        self.emit("e.assert_valid()", 3)
+        self.emit("return", 2)
+        self.emit("except StateChangeException as e:", 1)
+        self.emit("if not self.hsm_production:", 2)
+        self.emit("e.assert_valid()", 3)
+        self.emit("result = e.fn_new_state", 2)
+        self.emit("if result is HANDLED:", 1)
+        self.emit("return", 2)
+        self.emit(
+            f"_change_state(self, signal, {self.bind_state(state)}, {name}__transitions, result)",
+            1,
+        )
+        self.emit()
+        self.emit()
+        return name
+
+    def generate(self) -> str:
+        leaves = [
+            state
+            for state in self.topology.states
+            if state.fn_state is not None and len(state.substates) == 0
+        ]
+        leaf_names = [(state, self.emit_leaf(state)) for state in leaves]
+        body = self.lines
+        self.lines = []
+
+        self.emit('"""')
+        self.emit(
+            f"Generated by 'hsm.hsm_codegen' from '{self.cls.__module__}.{self.cls.__qualname__}': Do not edit!"
+        )
+        self.emit('"""')
+        self.emit("# pylint: skip-file")
+        self.emit("from hsm.hsm import (")
+        for name in (
+            "HANDLED",
+            "BadStatemachineException",
+            "DontChangeStateException",
+            "HsmMixin",
+            "HsmState",
+            "Ignore",
+            "IgnoreEventException",
+            "StateChangeException",
+            "Transition",
+            "_not_handled",
+        ):
+            self.emit(f"{name},", 1)
+        self.emit(")")
+        self.emit("from hsm.hsm_codegen import topology_signature")
+        self.emit(f"from {self.cls.__module__} import {self.cls.__qualname__} as _cls")
+        self.emit()
+        self.emit("_SIGNATURE = (")
+        for entry in topology_signature(self.topology):
+            self.emit(f"{entry!r},", 1)
+        self.emit(")")
+        self.emit("_TOPOLOGY = _cls.hsm_topology()")
+        self.emit("if topology_signature(_TOPOLOGY) != _SIGNATURE:")
+        self.emit("raise BadStatemachineException(", 1)
+        self.emit(
+            f"f\"'{self.cls.__qualname__}' has changed: Generate '{{__name__}}' again!\"", 2
+        )
+        self.emit(")", 1)
+        self.emit("_STATES = _TOPOLOGY.states")
+        for name in sorted(self.names, key=lambda name: (name[1], int(name[2:]))):
+            self.emit(f"{name} = {self.names[name]}")
+        self.emit()
+        self.emit()
+        self.lines.extend(_CHANGE_STATE.splitlines())
+        self.emit()
+        self.emit()
+        self.lines.extend(self.transition_lines)
+        self.lines.extend(body)
+        self.emit("_DISPATCH = {")
+        for state, name in leaf_names:
+            self.emit(f"{self.bind_state(state)}: {name},", 1)
+        self.emit("}")
+        self.emit()
+        self.emit()
+        self.lines.extend(_DISPATCH.splitlines())
+        return "\n".join(self.lines) + "\n"
+
+
+_CHANGE_STATE = '''def _change_state(self, signal, state_before, transitions, result):
+    result_class = result.__class__
+    if result_class is Ignore:
+        return
+    if result_class is Transition:
+        result = result.target
+    if result.__class__ is not HsmState:
+        result = _TOPOLOGY.state_from_fn(result)
+    fn = transitions.get(result, None)
+    if fn is not None:
+        fn(self, signal)
+        return
+    # Not unrolled: The target was not found in the code of the state handlers
+    plan = state_before.get_plan(result)
+    self._state_actual = plan.state_after
+    for action in plan.actions:
+        action(self, signal)'''
+
+_DISPATCH = '''def dispatch(self, signal):
+    """
+    Same as 'HsmMixin.dispatch()'.
+    With loggers, the reference implementation is used.
+    """
+    fn = _DISPATCH.get(self._state_actual, None)
+    if fn is None or self._loggers or self._dispatching or self._mailbox:
+        HsmMixin.dispatch(self, signal)
+        return
+    self._dispatching = True
+    try:
+        fn(self, signal)
+        mailbox = self._mailbox
+        while mailbox:
+            signal = mailbox.popleft()
+            fn = _DISPATCH.get(self._state_actual, None)
+            if fn is None:
+                self._dispatch(signal)
+            else:
+                fn(self, signal)
+    finally:
+        self._dispatching = False'''
+
+
+def generate(cls: type) -> str:
+    """
+    Return the source of the module with the dispatcher for 'cls'.
+    """
+    return _Generator(cls).generate()
+
+
+def write_module(cls: type, filename: pathlib.Path) -> None:
+    assert isinstance(filename, pathlib.Path)
+    filename.write_text(generate(cls))
+
+
+def verify(
+    factory: Callable[[], HsmMixin],
+    dispatch: Callable[[HsmMixin, SignalType], None],
+    signals: Sequence[SignalType],
+    count: int = 10_000,
+    seed: int = 0,
+    observe: Optional[Callable[[HsmMixin], Any]] = None,
+) -> None:
+    """
+    Differential test: Dispatch the same random signals to two machines
+    created by 'factory()', one using 'HsmMixin.dispatch()' and one using 'dispatch'.
+    After every signal, the states, the exceptions raised and 'observe(machine)'
+    have to be the same. Raise an AssertionError at the first difference.
+    """
+    machine_reference = factory()
+    machine_generated = factory()
+    rnd = random.Random(seed)
+
+    def call(fn: Callable[[], None]) -> Optional[Tuple[type, str]]:
+        try:
+            fn()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            return e.__class__, str(e)
+        return None
+
+    history: List[SignalType] = []
+    for _ in range(count):
+        signal = rnd.choice(signals)
+        history.append(signal)
+        error_reference = call(lambda: HsmMixin.dispatch(machine_reference, signal))
+        error_generated = call(lambda: dispatch(machine_generated, signal))
+        observed_reference = observed_generated = None
+        if observe is not None:
+            observed_reference = observe(machine_reference)
+            observed_generated = observe(machine_generated)
+        if (
+            error_reference != error_generated
+            or machine_reference.snapshot() != machine_generated.snapshot()
+            or observed_reference != observed_generated
+        ):
+            raise AssertionError(
+                f"Signal {len(history)} {signal!r} (seed={seed}, last signals {history[-10:]!r}): "
+                f"reference {machine_reference.get_state().full_name} {error_reference} {observed_reference!r}, "
+                f"generated {machine_generated.get_state().full_name} {error_generated} {observed_generated!r}"
+            )
+
+
+def _load_class(name: str) -> type:
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def main(argv: Iterable[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("cls", help="The statemachine class like 'my_module:MyStatemachine'")
+    parser.add_argument("filename", type=pathlib.Path, help="The module to be written")
+    args = parser.parse_args(argv)
+    write_module(_load_class(args.cls), args.filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+import dataclasses
+import io
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from hsm.hsm import HsmState, HsmTopology, StateType, _Verb
+
+_MERMAID_INDENT = "    "
+
+FORMATS = ("mermaid", "dot", "json")
+
+
+@dataclasses.dataclass(frozen=True, repr=True)
+class _Transition:
+    when: str
+    state_from: "HsmDiagramState" = dataclasses.field(repr=False)
+    state_to: "HsmDiagramState" = dataclasses.field(repr=False)
+
+    def link(self) -> None:
+        self.state_from.transitions_from.append(self)
+        self.state_to.transitions_to.append(self)
+
+
+class HsmDiagramState:
+    """
+    A state as shown in the diagram.
+    'state' is None for a state which only appears in a docstring ('phantom state').
+    """
+
+    def __init__(
+        self,
+        state: Optional[HsmState],
+        name: str = None,
+        outer_state: "HsmDiagramState" = None,
+    ):
+        self.state = state
+        self.name = name
+        self.outer_state = outer_state
+        self.path: tuple = () if outer_state is None else outer_state.path + (name,)
+        self.full_name = "_".join(self.path)
+        self.substates: Dict[str, "HsmDiagramState"] = {}
+        self.init_state: "HsmDiagramState" = None
+        self.fn_entry: StateType = None if state is None else state.fn_entry
+        self.fn_exit: StateType = None if state is None else state.fn_exit
+        self.transitions_from: List[_Transition] = []
+        self.transitions_to: List[_Transition] = []
+        self.exit_when: str = None
+
+    def find_state(self, name: str) -> "HsmDiagramState":
+        """
+        Find the substate. Create a phantom state if it does not exist.
+        """
+        substate = self.substates.get(name, None)
+        if substate is None:
+            substate = HsmDiagramState(state=None, name=name, outer_state=self)
+            self.substates[name] = substate
+        return substate
+
+    @property
+    def is_init_state(self) -> bool:
+        return self.outer_state.init_state is self
+
+    def mermaid_visible_name(self, mermaid_detailed: bool) -> str:
+        "The name including spaces"
+        if mermaid_detailed:
+            return f"State {self.name} ({self.full_name})"
+        return self.name
+
+    @property
+    def mermaid_tag(self) -> str:
+        "The tag referencing a state"
+        return self.full_name
+
+    def _mermaid_entry_exit(self, indent: str, mermaid_entryexit: bool) -> str:
+        "The exit transition and the notes for the entry/exit-actions"
+        lines: List[str] = []
+        if self.exit_when is not None:
+            lines.append(f"{indent}{self.mermaid_tag} --> [*]: {self.exit_when}\n")
+
+        if mermaid_entryexit:
+            for fn, tag in ((self.fn_entry, "entry"), (self.fn_exit, "exit")):
+                if fn is None:
+                    continue
+                doc = fn.__doc__
+                if doc is None:
+                    doc = "..."
+                lines.append(f"{indent}note right of {self.mermaid_tag}\n")
+                for line in f"on {tag}:\n{doc}".split("\n"):
+                    lines.append(f"{indent}   {line}\n")
+                lines.append(f"{indent}end note\n")
+        return "".join(lines)
+
+    def render_mermaid(self, f, mermaid_detailed: bool, mermaid_entryexit: bool) -> None:
+        # Depth first without recursion: A 'str' on the stack is written as is
+        stack: List[Union[HsmDiagramState, str]] = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                f.write(node)
+                continue
+            indent = _MERMAID_INDENT * len(node.path)
+            if len(node.substates) > 0:
+                assert (
+                    node.init_state is not None
+                ), f"No init_state for substate of {node.full_name}"
+                closing = f"{_MERMAID_INDENT}{indent}[*] --> {node.init_state.mermaid_tag}\n"
+                if node.name is not None:
+                    f.write(
+                        f"{indent}{node.mermaid_tag}: {node.mermaid_visible_name(mermaid_detailed)}\n"
+                    )
+                    f.write(f"{indent}state {node.mermaid_tag} {{\n")
+                    closing += f"{indent}}}\n"
+                stack.append(closing + node._mermaid_entry_exit(indent, mermaid_entryexit))
+                substates = list(node.substates.values())
+                for i in range(len(substates) - 1, -1, -1):
+                    stack.append(substates[i])
+                    if i > 0:
+                        stack.append("\n")
+                continue
+
+            f.write(
+                f"{indent}{node.mermaid_tag}: {node.mermaid_visible_name(mermaid_detailed)}\n"
+            )
+            f.write(f"{indent}state {node.mermaid_tag}\n")
+
+            if not node.is_init_state:
+                # Bugfix mermaid: Add at least one transistion - if not, mermaid will swallow the state
+                if len(node.transitions_from) + len(node.transitions_to) == 0:
+                    f.write(f"{indent}{node.mermaid_tag} --> {node.mermaid_tag}: Dummy\n")
+            f.write(node._mermaid_entry_exit(indent, mermaid_entryexit))
+
+
+class HsmDiagram:
+    """
+    The diagram of a statemachine class.
+    Built lazily by 'HsmTopology.diagram()': The runtime topology never
+    reads the docstrings and never contains phantom states.
+
+    'render()' supports the formats in 'FORMATS'. The output is cached per
+    format and options, the current state is added as an overlay to the
+    cached output.
+    """
+
+    def __init__(self, topology: HsmTopology):
+        self.topology = topology
+        self.top_state = HsmDiagramState(state=topology.top_state)
+        self._cache: Dict[Tuple[str, bool, bool], Tuple[str, str]] = {}
+        "(format, mermaid_detailed, mermaid_entryexit) -> (head, tail)"
+        self._build()
+
+    def _build(self) -> None:
+        nodes: Dict[HsmState, HsmDiagramState] = {
+            self.topology.top_state: self.top_state
+        }
+        # 'topology.states' is depth first: The outer state comes first
+        for state in self.topology.states[1:]:
+            outer_node = nodes[state.outer_state]
+            node = HsmDiagramState(state=state, name=state.name, outer_state=outer_node)
+            outer_node.substates[state.name] = node
+            nodes[state] = node
+        for state, node in nodes.items():
+            if state.init_state is not None:
+                node.init_state = nodes[state.init_state]
+
+        for state in self.topology.states[1:]:
+            self._parse_docstring(node=nodes[state], doc=state.fn_state.__doc__)
+
+    def find_state_by_name(self, fn_name: str) -> HsmDiagramState:
+        """
+        Find the state. Create phantom states if they do not exist.
+        """
+        assert fn_name.startswith(_Verb.STATE.value)
+        node = self.top_state
+        for name in fn_name[len(_Verb.STATE.value) :].split("_"):
+            node = node.find_state(name=name)
+        return node
+
+    def _parse_docstring(self, node: HsmDiagramState, doc: Optional[str]) -> None:
+        """
+        Parse the docstring.
+        Lines line 'TRANSITION state_0_2_2 time > 0' will create
+        a '_Transition()' object which will be attached to both states.
+        """
+        if doc is None:
+            return
+        tag_transition = "TRANSITION "
+        tag_exit = "EXIT "
+        for line in doc.split("\n"):
+            line = line.strip()
+            # Example line: 'TRANSITION state_0_2_2 time > 0'
+            if line.startswith(tag_transition):
+                line = line[len(tag_transition) :]
+                fn_name, _, when = line.partition(" ")
+                state_to = self.find_state_by_name(fn_name=fn_name)
+                transition = _Transition(state_to=state_to, state_from=node, when=when)
+                transition.link()
+                continue
+
+            if line.startswith(tag_exit):
+                when = line[len(tag_exit) :]
+                node.exit_when = when
+                continue
+
+    def iter_states(self):
+        "All states including the phantom states, depth first"
+        stack = [self.top_state]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.substates.values()))
+
+    def render_mermaid_transitions(self, f) -> None:
+        f.write(f"\n{_MERMAID_INDENT}%% Transitions\n")
+        for state in self.iter_states():
+            for transition_from in state.transitions_from:
+                f.write(
+                    f"{_MERMAID_INDENT}{state.mermaid_tag} --> {transition_from.state_to.mermaid_tag}: {transition_from.when}\n"
+                )
+
+    def render(
+        self,
+        fmt: str = "mermaid",
+        mermaid_detailed: bool = True,
+        mermaid_entryexit: bool = True,
+        current: Optional[HsmState] = None,
+    ) -> str:
+        """
+        Return the diagram in the format 'fmt'.
+        If 'current' is given, this state is highlighted.
+        """
+        key = (fmt, mermaid_detailed, mermaid_entryexit)
+        cached = self._cache.get(key, None)
+        if cached is None:
+            if fmt == "mermaid":
+                cached = self._render_mermaid(mermaid_detailed, mermaid_entryexit)
+            elif fmt == "dot":
+                cached = self._render_dot(mermaid_detailed, mermaid_entryexit)
+            elif fmt == "json":
+                cached = self._render_json(mermaid_entryexit)
+            else:
+                raise ValueError(f"Unknown format '{fmt}', expected one of {FORMATS}!")
+            self._cache[key] = cached
+        head, tail = cached
+        if current is None:
+            return head + tail
+        assert current.topology is self.topology
+        tag = current.full_name
+        if fmt == "mermaid":
+            overlay = f"{_MERMAID_INDENT}classDef hsm_current fill:#f96\n{_MERMAID_INDENT}class {tag} hsm_current\n"
+        elif fmt == "dot":
+            overlay = f'{_MERMAID_INDENT}"{tag}" [style="rounded,filled", fillcolor="#ff9966"];\n'
+        else:
+            overlay = f'"current": {json.dumps(tag)}, '
+        return head + overlay + tail
+
+    def _render_mermaid(
+        self, mermaid_detailed: bool, mermaid_entryexit: bool
+    ) -> Tuple[str, str]:
+        f = io.StringIO()
+        f.write("```mermaid\n")
+        f.write("stateDiagram-v2\n")
+        self.top_state.render_mermaid(
+            f=f,
+            mermaid_detailed=mermaid_detailed,
+            mermaid_entryexit=mermaid_entryexit,
+        )
+        self.render_mermaid_transitions(f=f)
+        return f.getvalue(), "```\n"
+
+    @staticmethod
+    def _anchor(node: HsmDiagramState) -> HsmDiagramState:
+        """
+        The leaf representing a composite state: Edges in DOT connect nodes, not clusters.
+        """
+        while len(node.substates) > 0:
+            if node.init_state is not None:
+                node = node.init_state
+            else:
+                node = next(iter(node.substates.values()))
+        return node
+
+    def _render_dot(
+        self, mermaid_detailed: bool, mermaid_entryexit: bool
+    ) -> Tuple[str, str]:
+        def quote(text: str) -> str:
+            text = text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            return f'"{text}"'
+
+        def label(node: HsmDiagramState) -> str:
+            lines = [node.mermaid_visible_name(mermaid_detailed)]
+            if mermaid_entryexit:
+                for fn in (node.fn_entry, node.fn_exit):
+                    if fn is not None:
+                        lines.append(f"{fn.__name__}()")
+            return quote("\n".join(lines))
+
+        def edge(text_from: str, text_to: str, attributes: List[str]) -> None:
+            text = f"{text_from} -> {text_to}"
+            if len(attributes) > 0:
+                text += f" [{', '.join(attributes)}]"
+            edges.append(f"{text};")
+
+        def anchor(node: HsmDiagramState, attribute: str) -> Tuple[str, List[str]]:
+            leaf = self._anchor(node)
+            if leaf is node:
+                return quote(leaf.mermaid_tag), []
+            return quote(leaf.mermaid_tag), [
+                f"{attribute}={quote('cluster_' + node.mermaid_tag)}"
+            ]
+
+        lines: List[str] = [
+            "digraph hsm {",
+            f"{_MERMAID_INDENT}compound=true;",
+            f"{_MERMAID_INDENT}node [shape=box, style=rounded];",
+        ]
+        edges: List[str] = []
+
+        # Depth first without recursion: A 'str' on the stack closes a cluster
+        stack: List[Union[HsmDiagramState, str]] = [self.top_state]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                lines.append(node)
+                continue
+            indent = _MERMAID_INDENT * max(len(node.path), 1)
+            tag = node.mermaid_tag
+            if len(node.substates) > 0:
+                if node.name is not None:
+                    lines.append(f"{indent}subgraph {quote('cluster_' + tag)} {{")
+                    lines.append(f"{indent}{_MERMAID_INDENT}label={label(node)};")
+                    stack.append(f"{indent}}}")
+                    indent += _MERMAID_INDENT
+                if node.init_state is not None:
+                    tag_init = quote(f"{tag}__init")
+                    lines.append(f"{indent}{tag_init} [shape=point];")
+                    text_to, attributes = anchor(node.init_state, "lhead")
+                    edge(tag_init, text_to, attributes)
+                stack.extend(reversed(node.substates.values()))
+            else:
+                lines.append(f"{indent}{quote(tag)} [label={label(node)}];")
+            if node.exit_when is not None:
+                # Outside of the cluster: The edge leaves the cluster
+                tag_exit = quote(f"{tag}__exit")
+                edges.append(f'{tag_exit} [shape=doublecircle, label="", width=0.15];')
+                text_from, attributes = anchor(node, "ltail")
+                edge(text_from, tag_exit, attributes + [f"label={quote(node.exit_when)}"])
+
+        for node in self.iter_states():
+            for transition in node.transitions_from:
+                text_from, attributes_from = anchor(transition.state_from, "ltail")
+                text_to, attributes_to = anchor(transition.state_to, "lhead")
+                edge(
+                    text_from,
+                    text_to,
+                    attributes_from
+                    + attributes_to
+                    + [f"label={quote(transition.when)}"],
+                )
+
+        lines.extend(f"{_MERMAID_INDENT}{e}" for e in edges)
+        return "\n".join(lines) + "\n", "}\n"
+
+    def _render_json(self, mermaid_entryexit: bool) -> Tuple[str, str]:
+        def doc(fn: StateType) -> Optional[str]:
+            if fn is None:
+                return None
+            return fn.__doc__ or "..."
+
+        states: List[Dict[str, Any]] = []
+        transitions: List[Dict[str, str]] = []
+        for node in self.iter_states():
+            if node is not self.top_state:
+                state: Dict[str, Any] = {
+                    "full_name": node.full_name,
+                    "name": node.name,
+                    "outer": node.outer_state.full_name,
+                    "init": None if node.init_state is None else node.init_state.full_name,
+                    "phantom": node.state is None,
+                    "exit_when": node.exit_when,
+                }
+                if mermaid_entryexit:
+                    state["entry"] = doc(node.fn_entry)
+                    state["exit"] = doc(node.fn_exit)
+                states.append(state)
+            for transition in node.transitions_from:
+                transitions.append(
+                    {
+                        "from": transition.state_from.full_name,
+                        "to": transition.state_to.full_name,
+                        "when": transition.when,
+                    }
+                )
+        text = json.dumps(
+            {
+                "init": self.top_state.init_state.full_name,
+                "states": states,
+                "transitions": transitions,
+            }
+        )
+        # The overlay is inserted after the opening brace
+        return text[:1], text[1:]
@@ -0,0 +1,169 @@
+import collections
+import concurrent.futures
+import dataclasses
+import threading
+import weakref
+from typing import Deque, List, Optional
+
+from hsm.hsm import HsmMixin, SignalType
+
+
+@dataclasses.dataclass(frozen=True)
+class HsmExecutorError:
+    machine: HsmMixin
+    signal: SignalType
+    exception: Exception
+
+
+class _HsmActor:
+    """
+    The mailbox of one statemachine.
+    At most one worker thread processes the mailbox at any time:
+    The signals of a machine are dispatched serially and in order.
+    """
+
+    def __init__(self, executor: "HsmExecutor"):
+        self._executor = executor
+        self._machine: Optional[HsmMixin] = None
+        """
+        The machine, only while signals are pending: An idle actor does not keep
+        the machine alive, see 'HsmExecutor._actors'.
+        """
+        self._lock = threading.Lock()
+        self._mailbox: Deque[SignalType] = collections.deque()
+        self._scheduled = False
+        "True if the actor is submitted to the pool or processed by a worker"
+        self.idle = threading.Event()
+        self.idle.set()
+
+    def post(self, machine: HsmMixin, signal: SignalType) -> None:
+        with self._lock:
+            self._mailbox.append(signal)
+            if self._scheduled:
+                return
+            self._scheduled = True
+            self._machine = machine
+            self.idle.clear()
+        self._executor._submit(self)
+
+    def run(self) -> None:
+        """
+        Called by a worker thread.
+        Process at most 'batch_size' signals, then give the other actors a chance.
+        """
+        machine = self._machine
+        assert machine is not None
+        with self._lock:
+            signals = [
+                self._mailbox.popleft()
+                for _ in range(min(len(self._mailbox), self._executor.batch_size))
+            ]
+
+        for signal in signals:
+            try:
+                machine.dispatch(signal)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._executor._add_error(
+                    HsmExecutorError(machine=machine, signal=signal, exception=e)
+                )
+        # 'join()' may return as soon as 'idle' is set: Do not hold the machine
+        del machine
+
+        with self._lock:
+            if len(self._mailbox) == 0:
+                self._scheduled = False
+                self._machine = None
+                self.idle.set()
+                return
+        self._executor._submit(self)
+
+
+class HsmExecutor:
+    """
+    Dispatches signals to many statemachines using a pool of worker threads.
+
+    Every machine is an actor: The signals to the same machine are dispatched
+    serially and in order, different machines are processed concurrently.
+    Posting to a machine only takes the lock of this machine.
+
+    Exceptions raised by 'dispatch()' are collected in 'errors'.
+
+    The executor does not make dispatching faster: Because of the GIL, it is
+    slower than dispatching behind one global lock, see 'bench_executor()'
+    in 'hsm_benchmark.py'.
+    Use it to serialize the signals per machine across threads, not for throughput.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, batch_size: int = 64):
+        assert batch_size >= 1
+        self.batch_size = batch_size
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hsm"
+        )
+        self._lock = threading.Lock()
+        self._actors: "weakref.WeakKeyDictionary[HsmMixin, _HsmActor]" = (
+            weakref.WeakKeyDictionary()
+        )
+        "The actors of the machines still referenced elsewhere"
+        self._shutdown = False
+        self.errors: List[HsmExecutorError] = []
+
+    def __enter__(self) -> "HsmExecutor":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+
+    def _get_actor(self, machine: HsmMixin) -> _HsmActor:
+        actor = self._actors.get(machine, None)
+        if actor is not None:
+            return actor
+        with self._lock:
+            actor = self._actors.get(machine, None)
+            if actor is None:
+                machine.assert_initialized()
+                actor = _HsmActor(executor=self)
+                self._actors[machine] = actor
+            return actor
+
+    def _submit(self, actor: _HsmActor) -> None:
+        self._pool.submit(actor.run)
+
+    def _add_error(self, error: HsmExecutorError) -> None:
+        with self._lock:
+            self.errors.append(error)
+
+    def post(self, machine: HsmMixin, signal: SignalType) -> None:
+        """
+        Queue a signal for the machine. May be called from any thread,
+        also from a state handler of a machine processed by this executor.
+        """
+        if self._shutdown:
+            raise RuntimeError("The executor is shut down!")
+        self._get_actor(machine).post(machine, signal)
+
+    def join(self) -> None:
+        """
+        Wait till all posted signals have been processed,
+        including the signals posted meanwhile.
+        """
+        while True:
+            waited = False
+            with self._lock:
+                actors = list(self._actors.values())
+            for actor in actors:
+                if not actor.idle.is_set():
+                    actor.idle.wait()
+                    waited = True
+            if not waited:
+                return
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        'post()' raises from now on.
+        If 'wait': Process the posted signals first, see 'join()'.
+        """
+        if wait:
+            self.join()
+        self._shutdown = True
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,90 @@
+import collections
+from typing import Dict, Iterator, List, Tuple
+
+from hsm.hsm import HsmMixin, HsmState, SignalType
+
+
+class HsmFleet:
+    """
+    Many statemachines of the same class.
+
+    'dispatch()' sends the same signal to all members: The members are grouped
+    by their actual state and the chain of state handlers is resolved once
+    per group. The transitions are then applied per member, exactly as
+    'HsmMixin.dispatch()' would do.
+    """
+
+    def __init__(self, cls: type):
+        assert issubclass(cls, HsmMixin)
+        self.cls = cls
+        self.topology = cls.hsm_topology()
+        self._members: List[HsmMixin] = []
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __iter__(self) -> Iterator[HsmMixin]:
+        return iter(self._members)
+
+    def add(self, machine: HsmMixin) -> None:
+        assert type(machine) is self.cls, f"Expected '{self.cls.__name__}'!"
+        machine.assert_initialized()
+        self._members.append(machine)
+
+    def remove(self, machine: HsmMixin) -> None:
+        self._members.remove(machine)
+
+    def group_by_state(self) -> Dict[HsmState, List[HsmMixin]]:
+        groups: Dict[HsmState, List[HsmMixin]] = {}
+        for machine in self._members:
+            state = machine._state_actual
+            try:
+                groups[state].append(machine)
+            except KeyError:
+                groups[state] = [machine]
+        return groups
+
+    def count_by_state(self) -> Dict[str, int]:
+        """
+        Return 'full_name' of the state -> number of members in this state.
+        """
+        return {
+            state.full_name: len(machines)
+            for state, machines in self.group_by_state().items()
+        }
+
+    def dispatch(self, signal: SignalType) -> Dict[str, int]:
+        """
+        Dispatch the signal to all members.
+        Return 'full_name' of the state -> number of members in this state.
+        """
+        counter: Dict[HsmState, int] = collections.Counter()
+        for state, machines in self.group_by_state().items():
+            chain = state.handler_chain(signal)
+            for machine in machines:
+                if machine._dispatching:
+                    # Called from a state handler of this member
+                    machine.post(signal)
+                elif (machine._state_actual is not state) or machine._mailbox:
+                    # Changed meanwhile by a state handler of another member
+                    # or signals posted before: Processed first
+                    machine.dispatch(signal)
+                else:
+                    self._dispatch_member(machine, signal, chain)
+                counter[machine._state_actual] += 1
+        return {state.full_name: count for state, count in counter.items()}
+
+    @staticmethod
+    def _dispatch_member(
+        machine: HsmMixin, signal: SignalType, chain: Tuple[HsmState, ...]
+    ) -> None:
+        """
+        Same as 'HsmMixin.dispatch()', but the state handlers are taken from 'chain'.
+        """
+        machine._dispatching = True
+        try:
+            machine._dispatch(signal, chain)
+            if machine._mailbox:
+                machine._drain_mailbox()
+        finally:
+            machine._dispatching = False
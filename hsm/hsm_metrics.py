@@ -0,0 +1,220 @@
+import array
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from hsm.hsm import _HSM_VALUE, HsmLogEvent, HsmMixin, HsmState, HsmTopology
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _HsmCounters:
+    """
+    Entries and dwell time per state.
+    """
+
+    def __init__(self, count: int):
+        self.entries = array.array("Q", [0]) * count
+        "state_id -> number of transitions into the state"
+        self.dwell_ns = array.array("Q", [0]) * count
+        "state_id -> time spent in the state, without the time since the last transition"
+
+
+class HsmMetrics(_HsmCounters):
+    """
+    The metrics of one machine: Entries and dwell time per state.
+    Attaches itself as logger for 'HsmLogEvent.STATE_CHANGE'.
+
+    A transition updates two array elements of this machine only:
+    No locks, no allocations and no counters shared with other machines.
+    The states are the actual states, which are the init-states of the transition targets.
+    The actual state is always read from the machine: It may also be changed
+    by 'force_state()', 'restore()' or 'hsm_unpack()'.
+    """
+
+    log_events = HsmLogEvent.STATE_CHANGE
+
+    def __init__(self, machine: HsmMixin, name: str):
+        self.machine = machine
+        self.name = name
+        self.topology: HsmTopology = machine.get_state().topology
+        super().__init__(count=len(self.topology.states))
+        self._since_ns = time.monotonic_ns()
+        machine.add_logger(self)
+
+    @property
+    def state_id(self) -> int:
+        return self.machine._state_actual.state_id
+
+    def fn_log_info(self, msg: str) -> None:
+        pass
+
+    def fn_log_debug(self, msg: str) -> None:
+        pass
+
+    def fn_state_change(
+        self,
+        before: HsmState,
+        after: HsmState,
+        why: str,
+        list_entry_exit: List[str],
+    ) -> None:
+        now_ns = time.monotonic_ns()
+        duration_ns = now_ns - self._since_ns
+        self._since_ns = now_ns
+        self.dwell_ns[before.state_id] += duration_ns
+        self.entries[after.state_id] += 1
+
+    def detach(self) -> None:
+        """
+        Remove the logger from the machine. The time since the last transition is added.
+        """
+        self.machine.remove_logger(self)
+        now_ns = time.monotonic_ns()
+        self.dwell_ns[self.state_id] += now_ns - self._since_ns
+        self._since_ns = now_ns
+
+    def snapshot(self) -> Tuple[int, array.array, array.array]:
+        """
+        Return (state_id, entries, dwell_ns) including the time since the last transition.
+        """
+        state_id = self.state_id
+        since_ns = self._since_ns
+        entries = array.array("Q", self.entries)
+        dwell_ns = array.array("Q", self.dwell_ns)
+        dwell_ns[state_id] += time.monotonic_ns() - since_ns
+        return state_id, entries, dwell_ns
+
+
+class HsmMetricsRegistry(_HsmCounters):
+    """
+    The metrics of all registered machines of a class.
+    'scrape()' returns the Prometheus text format.
+
+    'entries' and 'dwell_ns' are the totals of the removed machines.
+    The counters of the registered machines are summed up by 'scrape()'.
+    """
+
+    def __init__(self, cls: type):
+        assert issubclass(cls, HsmMixin)
+        self.cls = cls
+        self.topology = cls.hsm_topology()
+        super().__init__(count=len(self.topology.states))
+        self._lock = threading.Lock()
+        "Protects 'machines' and the totals of the removed machines"
+        self.machines: Dict[str, HsmMetrics] = {}
+        self._states = [
+            state for state in self.topology.states if state.fn_state is not None
+        ]
+        self._values: List[Optional[int]] = [
+            getattr(state.fn_state, _HSM_VALUE, None) for state in self.topology.states
+        ]
+
+    def add(self, machine: HsmMixin, name: str) -> HsmMetrics:
+        assert type(machine) is self.cls, f"Expected '{self.cls.__name__}'!"
+        with self._lock:
+            assert name not in self.machines, f"Machine '{name}' already exists!"
+            metrics = HsmMetrics(machine=machine, name=name)
+            self.machines[name] = metrics
+        return metrics
+
+    def remove(self, name: str) -> None:
+        """
+        Detach the machine. Its counts remain in the totals.
+        """
+        with self._lock:
+            metrics = self.machines.pop(name)
+            metrics.detach()
+            for state_id, count in enumerate(metrics.entries):
+                self.entries[state_id] += count
+            for state_id, dwell_ns in enumerate(metrics.dwell_ns):
+                self.dwell_ns[state_id] += dwell_ns
+
+    def scrape(self, per_machine: bool = False) -> str:
+        """
+        Return the metrics in the Prometheus text format.
+        Aggregated over all machines: The counters per state and the number
+        of machines per state.
+        If 'per_machine': The counters per machine and state and the value of
+        the actual state, see '@hsm.value'.
+        """
+        label_class = f'class="{_escape(self.cls.__name__)}"'
+        lines: List[str] = []
+
+        def header(name: str, kind: str, text: str) -> None:
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def fmt(counter: int, in_seconds: bool) -> str:
+            return repr(counter / 1e9) if in_seconds else str(counter)
+
+        with self._lock:
+            machines = list(self.machines.values())
+            entries = list(self.entries)
+            dwell_ns = list(self.dwell_ns)
+
+        if per_machine:
+            snapshots = [(metrics.name, metrics.snapshot()) for metrics in machines]
+
+            def samples(
+                name: str, counters_by_machine: List[Tuple[str, array.array]], in_seconds: bool
+            ) -> None:
+                for machine_name, counters in counters_by_machine:
+                    label_machine = f'machine="{_escape(machine_name)}"'
+                    for state in self._states:
+                        lines.append(
+                            f'{name}{{{label_class},{label_machine},state="{state.full_name}"}} {fmt(counters[state.state_id], in_seconds)}'
+                        )
+
+            header("hsm_state_entries_total", "counter", "Transitions into the state.")
+            samples(
+                "hsm_state_entries_total",
+                [(machine_name, entries) for machine_name, (_, entries, _) in snapshots],
+                in_seconds=False,
+            )
+            header("hsm_state_dwell_seconds_total", "counter", "Time spent in the state.")
+            samples(
+                "hsm_state_dwell_seconds_total",
+                [(machine_name, dwell_ns) for machine_name, (_, _, dwell_ns) in snapshots],
+                in_seconds=True,
+            )
+            header(
+                "hsm_state_value",
+                "gauge",
+                "The value of the actual state, see '@hsm.value'.",
+            )
+            for machine_name, (state_id, _, _) in snapshots:
+                value = self._values[state_id]
+                if value is not None:
+                    lines.append(
+                        f'hsm_state_value{{{label_class},machine="{_escape(machine_name)}"}} {value}'
+                    )
+            return "\n".join(lines) + "\n"
+
+        # The removed machines plus the counters of every registered machine
+        now_ns = time.monotonic_ns()
+        counts = [0] * len(self.topology.states)
+        for metrics in machines:
+            for state_id, count in enumerate(metrics.entries):
+                entries[state_id] += count
+            for state_id, duration_ns in enumerate(metrics.dwell_ns):
+                dwell_ns[state_id] += duration_ns
+            state_id = metrics.state_id
+            dwell_ns[state_id] += now_ns - metrics._since_ns
+            counts[state_id] += 1
+
+        def totals(name: str, counters: List[int], in_seconds: bool) -> None:
+            for state in self._states:
+                lines.append(
+                    f'{name}{{{label_class},state="{state.full_name}"}} {fmt(counters[state.state_id], in_seconds)}'
+                )
+
+        header("hsm_state_entries_total", "counter", "Transitions into the state.")
+        totals("hsm_state_entries_total", entries, in_seconds=False)
+        header("hsm_state_dwell_seconds_total", "counter", "Time spent in the state.")
+        totals("hsm_state_dwell_seconds_total", dwell_ns, in_seconds=True)
+        header("hsm_state_machines", "gauge", "The machines in the state.")
+        totals("hsm_state_machines", counts, in_seconds=False)
+        return "\n".join(lines) + "\n"
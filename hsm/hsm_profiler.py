@@ -0,0 +1,231 @@
+import array
+import functools
+import inspect
+import time
+import types
+from typing import Any, Callable, Dict, List, Tuple
+
+from hsm.hsm import HsmMixin, HsmState, HsmTopology, SignalType, _TransitionPlan
+
+_BUCKETS = 64
+
+
+class HsmHistogram:
+    """
+    Durations in log2 buckets: Bucket 'n' counts the durations
+    from 2**(n-1) up to 2**n-1 ns.
+    """
+
+    __slots__ = ("count", "total_ns", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.buckets = array.array("Q", [0]) * _BUCKETS
+
+    def add(self, duration_ns: int) -> None:
+        self.count += 1
+        self.total_ns += duration_ns
+        self.buckets[min(duration_ns.bit_length(), _BUCKETS - 1)] += 1
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count if self.count > 0 else 0.0
+
+    def percentile_ns(self, percent: float) -> int:
+        """
+        Return the upper bound of the bucket containing the percentile.
+        """
+        limit = self.count * percent / 100.0
+        count = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            count += bucket_count
+            if count >= limit and count > 0:
+                return (1 << bucket) - 1
+        return 0
+
+    def __repr__(self) -> str:
+        return f"HsmHistogram(count={self.count}, mean_ns={self.mean_ns:.0f}, p99_ns<={self.percentile_ns(99)})"
+
+
+class HsmProfiler:
+    """
+    Measures the time spent in the state handlers, the entry/exit-actions
+    and the exit/entry-actions of every transition of a statemachine class.
+
+    'enable()' swaps the functions of the topology by instrumented ones and
+    'disable()' restores them: A disabled profiler costs nothing.
+    The profiler applies to all instances of the class.
+    For 'AsyncHsmMixin', the async handlers, actions and transitions are measured
+    till the awaited coroutine completes.
+    'HsmTableMixin.dispatch_id()' uses the plans of its table and is not measured.
+    """
+
+    def __init__(self, cls: type):
+        assert issubclass(cls, HsmMixin)
+        self.cls = cls
+        self.topology: HsmTopology = cls.hsm_topology()
+        self.histograms: Dict[str, HsmHistogram] = {}
+        "Name of the function like 'state_TopA' or 'entry_TopA' -> histogram"
+        self.transitions: Dict[Tuple[str, str], HsmHistogram] = {}
+        "('full_name' before, 'full_name' after) -> histogram of all exit/entry-actions"
+        self._originals: Dict[HsmState, Tuple[Callable, Callable, Callable]] = {}
+
+    def __enter__(self) -> "HsmProfiler":
+        self.enable()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.disable()
+
+    @property
+    def enabled(self) -> bool:
+        return len(self._originals) > 0
+
+    def _histogram(self, name: str) -> HsmHistogram:
+        histogram = self.histograms.get(name, None)
+        if histogram is None:
+            histogram = self.histograms[name] = HsmHistogram()
+        return histogram
+
+    def _instrument(self, fn: Callable) -> Callable:
+        if fn is None:
+            return None
+        histogram = self._histogram(fn.__name__)
+        perf_counter_ns = time.perf_counter_ns
+
+        async def awaited(coroutine: Any, start: int) -> Any:
+            try:
+                return await coroutine
+            finally:
+                histogram.add(perf_counter_ns() - start)
+
+        @functools.wraps(fn)
+        def instrumented(hsm_self: HsmMixin, signal: SignalType):
+            start = perf_counter_ns()
+            try:
+                result = fn(hsm_self, signal)
+            except BaseException:
+                histogram.add(perf_counter_ns() - start)
+                raise
+            if result.__class__ is types.CoroutineType:
+                # 'async def': Measured till the coroutine is awaited by the dispatcher
+                return awaited(result, start)
+            histogram.add(perf_counter_ns() - start)
+            return result
+
+        return instrumented
+
+    def _instrument_call_plan(self) -> Callable:
+        # Sync or async, see 'AsyncHsmMixin._call_plan()'
+        call_plan: Callable[..., Any] = self.cls._call_plan
+        transitions = self.transitions
+        perf_counter_ns = time.perf_counter_ns
+
+        def add(plan: _TransitionPlan, duration_ns: int) -> None:
+            key = (plan.state_before.full_name, plan.state_after.full_name)
+            histogram = transitions.get(key, None)
+            if histogram is None:
+                histogram = transitions[key] = HsmHistogram()
+            histogram.add(duration_ns)
+
+        if inspect.iscoroutinefunction(call_plan):
+            # 'AsyncHsmMixin': The exit/entry-actions are awaited
+
+            async def _call_plan_async(
+                hsm_self: HsmMixin, signal: SignalType, plan: _TransitionPlan
+            ) -> None:
+                start = perf_counter_ns()
+                try:
+                    await call_plan(hsm_self, signal=signal, plan=plan)
+                finally:
+                    add(plan, perf_counter_ns() - start)
+
+            return _call_plan_async
+
+        def _call_plan(
+            hsm_self: HsmMixin, signal: SignalType, plan: _TransitionPlan
+        ) -> None:
+            start = perf_counter_ns()
+            try:
+                return call_plan(hsm_self, signal=signal, plan=plan)
+            finally:
+                add(plan, perf_counter_ns() - start)
+
+        return _call_plan
+
+    @staticmethod
+    def _set(state: HsmState, fn_handle: Callable, fn_entry: Callable, fn_exit: Callable):
+        # The state is frozen. The cached plans refer to the previous entry/exit-actions.
+        object.__setattr__(state, "fn_handle", fn_handle)
+        object.__setattr__(state, "fn_entry", fn_entry)
+        object.__setattr__(state, "fn_exit", fn_exit)
+        object.__setattr__(state, "plans", None)
+
+    def enable(self) -> None:
+        assert not self.enabled, "Already enabled!"
+        assert "_call_plan" not in self.cls.__dict__, "Another profiler is enabled!"
+        for state in self.topology.states:
+            if state.fn_state is None:
+                continue
+            self._originals[state] = (state.fn_handle, state.fn_entry, state.fn_exit)
+            self._set(
+                state,
+                fn_handle=self._instrument(state.fn_handle),
+                fn_entry=self._instrument(state.fn_entry),
+                fn_exit=self._instrument(state.fn_exit),
+            )
+        # Shadows the method of 'HsmMixin' till 'disable()'
+        setattr(self.cls, "_call_plan", self._instrument_call_plan())
+
+    def disable(self) -> None:
+        assert self.enabled, "Not enabled!"
+        del self.cls._call_plan
+        for state, (fn_handle, fn_entry, fn_exit) in self._originals.items():
+            self._set(state, fn_handle=fn_handle, fn_entry=fn_entry, fn_exit=fn_exit)
+        self._originals.clear()
+
+    def top(self, n: int = 10) -> List[Tuple[str, HsmHistogram]]:
+        """
+        The 'n' functions with the most time spent.
+        """
+        return sorted(
+            self.histograms.items(), key=lambda item: item[1].total_ns, reverse=True
+        )[:n]
+
+    def top_transitions(self, n: int = 10) -> List[Tuple[Tuple[str, str], HsmHistogram]]:
+        """
+        The 'n' transitions with the most time spent in exit/entry-actions.
+        """
+        return sorted(
+            self.transitions.items(), key=lambda item: item[1].total_ns, reverse=True
+        )[:n]
+
+    def dump(self, n: int = 10) -> str:
+        """
+        Render the top 'n' functions and transitions as text.
+        """
+        lines = [self._format_line("function", "count", "total_us", "mean_ns", "p99_ns<=")]
+        for name, histogram in self.top(n):
+            lines.append(self._format_histogram(name, histogram))
+        lines.append("")
+        lines.append(
+            self._format_line("transition", "count", "total_us", "mean_ns", "p99_ns<=")
+        )
+        for (before, after), histogram in self.top_transitions(n):
+            lines.append(self._format_histogram(f"{before} ==> {after}", histogram))
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_line(name: str, *columns: str) -> str:
+        return f"{name:<40}" + "".join(f" {column:>10}" for column in columns)
+
+    @staticmethod
+    def _format_histogram(name: str, histogram: HsmHistogram) -> str:
+        return HsmProfiler._format_line(
+            name,
+            str(histogram.count),
+            f"{histogram.total_ns / 1000.0:.1f}",
+            f"{histogram.mean_ns:.0f}",
+            str(histogram.percentile_ns(99)),
+        )
@@ -0,0 +1,165 @@
+import array
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from hsm.hsm import (
+    HsmLogEvent,
+    HsmOutcome,
+    HsmState,
+    HsmStringIoLogger,
+    HsmTopology,
+    SignalType,
+)
+
+_NONE = -1
+"Field value for 'target' if not given"
+
+_FIELDS = 5
+"from, to, target, handler, outcome"
+
+
+class HsmRecorder:
+    """
+    A logger recording every signal into a preallocated ring buffer.
+
+    Every record has a fixed width: The monotonic timestamp in ns and the
+    ids of the state before, the state after, the target and the handling
+    state and the 'HsmOutcome'. The signal and the 'why' are referenced
+    in slots of the same ring: Nothing is hashed or interned.
+    When the buffer is full, the oldest records are overwritten.
+
+    Nothing is formatted while recording: 'dump()' renders the records in
+    the format of 'HsmStringIoLogger'.
+    May be shared by many machines of the same class.
+    """
+
+    log_events = HsmLogEvent.OUTCOME
+
+    def __init__(self, capacity: int = 65536):
+        assert capacity >= 1
+        self.capacity = capacity
+        self.count = 0
+        "Number of records written, including the overwritten ones"
+        self._timestamps = array.array("q", [0]) * capacity
+        self._records = array.array("i", [0]) * (capacity * _FIELDS)
+        self._topology: HsmTopology = None
+        self._signals: List[SignalType] = [None] * capacity
+        self._whys: List[Optional[str]] = [None] * capacity
+
+    def fn_log_info(self, msg: str) -> None:
+        pass
+
+    def fn_log_debug(self, msg: str) -> None:
+        pass
+
+    def fn_state_change(
+        self,
+        before: HsmState,
+        after: HsmState,
+        why: str,
+        list_entry_exit: List[str],
+    ) -> None:
+        pass
+
+    def fn_outcome(
+        self,
+        signal: SignalType,
+        before: HsmState,
+        handler: HsmState,
+        target: Optional[HsmState],
+        outcome: HsmOutcome,
+        why: Optional[str],
+    ) -> None:
+        if self._topology is not before.topology:
+            assert self._topology is None, "All machines have to be of the same class!"
+            self._topology = before.topology
+
+        index = self.count % self.capacity
+        self.count += 1
+        self._timestamps[index] = time.monotonic_ns()
+        self._signals[index] = signal
+        self._whys[index] = why
+        after = before
+        target_id = _NONE
+        if target is not None:
+            after = before.get_plan(target).state_after
+            target_id = target.state_id
+
+        position = index * _FIELDS
+        records = self._records
+        records[position] = before.state_id
+        records[position + 1] = after.state_id
+        records[position + 2] = target_id
+        records[position + 3] = handler.state_id
+        records[position + 4] = outcome
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def iter_records(
+        self,
+    ) -> Iterator[
+        Tuple[int, HsmState, HsmState, HsmState, HsmState, SignalType, HsmOutcome, str]
+    ]:
+        """
+        Yield the records, oldest first:
+        (timestamp_ns, before, after, target, handler, signal, outcome, why)
+        'target' and 'why' may be None.
+        """
+        states = self._topology.states if self._topology is not None else []
+        for i in range(self.count - len(self), self.count):
+            index = i % self.capacity
+            position = index * _FIELDS
+            before, after, target, handler, outcome = self._records[
+                position : position + _FIELDS
+            ]
+            yield (
+                self._timestamps[index],
+                states[before],
+                states[after],
+                None if target == _NONE else states[target],
+                states[handler],
+                self._signals[index],
+                HsmOutcome(outcome),
+                self._whys[index],
+            )
+
+    def dump(self) -> str:
+        """
+        Render the records in the format of 'HsmStringIoLogger'.
+        """
+        lines: List[str] = []
+        for (
+            _timestamp,
+            before,
+            after,
+            target,
+            handler,
+            signal,
+            outcome,
+            why,
+        ) in self.iter_records():
+            signal_repr, signal_str = repr(signal), str(signal)
+            why_text = "" if why is None else f" ({why})"
+            lines.append(f"{signal_repr}: will be handled by {before.full_name}")
+            lines.append(f'>   calling state "state_{before.full_name}({signal_str})"')
+            if outcome is HsmOutcome.HANDLED:
+                lines.append(">   No state change!")
+                continue
+            if outcome is HsmOutcome.IGNORED:
+                lines.append(f">   Empty Transition!{why_text}")
+                continue
+            lines.append(f"> {signal_str}: was handled by state_{handler.full_name}")
+            if after is not target:
+                lines.append(
+                    f">   Init-State for {target.full_name} is {after.full_name}."
+                )
+            names = before.get_plan(target).names
+            lines.extend(f">   Calling {name}" for name in names)
+            text_entry_exit = "==>"
+            if len(names) > 0:
+                text_entry_exit = f"==>{'==>'.join(names)}==>"
+            lines.append(
+                f">>> {before.full_name} {text_entry_exit} {after.full_name}{why_text}"
+            )
+        return HsmStringIoLogger.strip_string("\n".join(lines))
@@ -0,0 +1,198 @@
+import concurrent.futures
+import dataclasses
+import json
+import pathlib
+import struct
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from hsm.hsm import (
+    BadStateException,
+    BadStatemachineException,
+    HsmMixin,
+    HsmState,
+    SignalType,
+)
+from hsm.hsm_recorder import HsmRecorder
+
+_MAGIC = b"HSMTRACE1\n"
+_RECORD = struct.Struct("<II")
+"signal_id, state_id after the signal"
+_CHUNK_RECORDS = 65536
+
+
+def write_trace(recorder: HsmRecorder, filename: pathlib.Path) -> int:
+    """
+    Write the records of a recorder attached to ONE machine into a trace file.
+    The signals have to be serializable by 'json'.
+    Return the number of records written.
+
+    Format: A magic line, a json line with the signals and the states, then
+    one fixed width record per signal.
+    """
+    assert isinstance(filename, pathlib.Path)
+    records = list(recorder.iter_records())
+    states = recorder._topology.states if len(records) > 0 else []
+
+    # Intern the signals by their json text: Unhashable signals are supported too
+    signals: List[SignalType] = []
+    signal_ids: Dict[str, int] = {}
+    packed: List[bytes] = []
+    for _, _, after, _, _, signal, _, _ in records:
+        key = json.dumps(signal)
+        signal_id = signal_ids.get(key, None)
+        if signal_id is None:
+            signal_id = signal_ids[key] = len(signals)
+            signals.append(signal)
+        packed.append(_RECORD.pack(signal_id, after.state_id))
+
+    header = {
+        "signals": signals,
+        "states": [state.full_name for state in states],
+        "start": records[0][1].full_name if len(records) > 0 else None,
+    }
+    with filename.open("wb") as f:
+        f.write(_MAGIC)
+        f.write(json.dumps(header).encode("utf-8") + b"\n")
+        f.writelines(packed)
+    return len(records)
+
+
+class HsmTrace:
+    """
+    A trace file written by 'write_trace()'.
+    The records are streamed in chunks and never loaded as a whole.
+    """
+
+    def __init__(self, filename: pathlib.Path):
+        assert isinstance(filename, pathlib.Path)
+        self.filename = filename
+        with filename.open("rb") as f:
+            if f.readline() != _MAGIC:
+                raise ValueError(f"{filename}: Not a trace file!")
+            header = json.loads(f.readline())
+            self._offset = f.tell()
+        self.signals: List[SignalType] = header["signals"]
+        self.states: List[str] = header["states"]
+        "state_id when recorded -> 'full_name'"
+        self.start: Optional[str] = header["start"]
+        "The 'full_name' of the state before the first signal"
+
+    def iter_records(self) -> Iterator[Tuple[int, int]]:
+        """
+        Yield (signal_id, state_id after the signal).
+        """
+        with self.filename.open("rb") as f:
+            f.seek(self._offset)
+            while True:
+                chunk = f.read(_RECORD.size * _CHUNK_RECORDS)
+                if len(chunk) == 0:
+                    return
+                yield from _RECORD.iter_unpack(chunk)
+
+
+@dataclasses.dataclass(frozen=True)
+class HsmDivergence:
+    index: int
+    "The index of the signal in the trace"
+    signal: Optional[SignalType]
+    "None if the start state of the trace does not exist anymore"
+    expected: str
+    "The 'full_name' of the state as recorded"
+    actual: str
+    exception: Optional[str] = None
+    "The exception raised by 'dispatch()'"
+    unknown_state: bool = False
+    "True if the recorded state does not exist in the class anymore"
+
+
+@dataclasses.dataclass(frozen=True)
+class HsmReplayResult:
+    filename: pathlib.Path
+    count: int
+    "The number of signals replayed"
+    divergence: Optional[HsmDivergence]
+    "The first divergence, None if the replay matches the trace"
+
+
+def replay(factory: Callable[[], HsmMixin], filename: pathlib.Path) -> HsmReplayResult:
+    """
+    Feed the signals of a trace into a fresh machine created by 'factory()'
+    and compare the state after every signal with the recorded state.
+    The machine is restored to the start state of the trace, 'init()' and
+    the entry-actions are not called. The loggers of the machine are removed.
+    """
+    trace = HsmTrace(filename)
+    machine = factory()
+    machine._set_loggers(())
+    if trace.start is None:
+        return HsmReplayResult(filename=filename, count=0, divergence=None)
+    try:
+        machine.restore(trace.start)
+    except (BadStateException, BadStatemachineException) as e:
+        divergence = HsmDivergence(
+            index=0,
+            signal=None,
+            expected=trace.start,
+            actual="",
+            exception=repr(e),
+            unknown_state=True,
+        )
+        return HsmReplayResult(filename=filename, count=0, divergence=divergence)
+
+    topology = machine.hsm_topology()
+    # The state ids may have changed since the trace was recorded: Map by name.
+    # Resolved on first use: A state which does not exist anymore is a divergence.
+    expected_states: Dict[int, Optional[HsmState]] = {}
+
+    def expected_state(state_id: int) -> Optional[HsmState]:
+        try:
+            return expected_states[state_id]
+        except KeyError:
+            pass
+        full_name = trace.states[state_id]
+        try:
+            state = topology.find_state(path=full_name.split("_")) if full_name else None
+        except BadStatemachineException:
+            state = None
+        expected_states[state_id] = state
+        return state
+
+    signals = trace.signals
+    dispatch = machine.dispatch
+
+    index = -1
+    for index, (signal_id, state_id) in enumerate(trace.iter_records()):
+        signal = signals[signal_id]
+        expected = expected_state(state_id)
+        exception = None
+        try:
+            dispatch(signal)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            exception = repr(e)
+        if (exception is not None) or (machine._state_actual is not expected):
+            divergence = HsmDivergence(
+                index=index,
+                signal=signal,
+                expected=trace.states[state_id],
+                actual=machine._state_actual.full_name,
+                exception=exception,
+                unknown_state=expected is None,
+            )
+            return HsmReplayResult(
+                filename=filename, count=index + 1, divergence=divergence
+            )
+    return HsmReplayResult(filename=filename, count=index + 1, divergence=None)
+
+
+def replay_many(
+    factory: Callable[[], HsmMixin],
+    filenames: Iterable[pathlib.Path],
+    max_workers: Optional[int] = None,
+) -> List[HsmReplayResult]:
+    """
+    Replay the traces in a process pool.
+    'factory' has to be picklable, for example a class defined in a module.
+    """
+    filenames = list(filenames)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(replay, [factory] * len(filenames), filenames))
@@ -0,0 +1,180 @@
+import pathlib
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List
+
+from hsm.hsm import HsmLogEvent, HsmMixin, HsmState, SignalType
+
+
+class _HsmStoreLogger:
+    """
+    Attached to every machine of the store: Records the new state on every transition.
+    """
+
+    log_events = HsmLogEvent.STATE_CHANGE
+
+    def __init__(self, store: "HsmStore", key: str):
+        self._store = store
+        self._key = key
+
+    def fn_log_info(self, msg: str) -> None:
+        pass
+
+    def fn_log_debug(self, msg: str) -> None:
+        pass
+
+    def fn_state_change(
+        self,
+        before: HsmState,
+        after: HsmState,
+        why: str,
+        list_entry_exit: List[str],
+    ) -> None:
+        self._store._record(key=self._key, state=after)
+
+
+class HsmStore:
+    """
+    Persists the state of many machines by key in a SQLite database.
+
+    Write-behind: A transition only updates a dict in memory. The pending
+    states are written in one transaction when 'flush_count' machines changed
+    or 'flush_interval_s' elapsed since the last flush. A crash therefore
+    loses at most one flush window. The time threshold is checked on every
+    transition: Call 'flush()' if the machines may be idle for a long time.
+
+    The machines are loaded lazily by 'get()' or on the first 'dispatch()':
+    The state is restored without calling 'init()' or any entry-actions.
+    The store holds a machine only till the next flush: A machine which is
+    not referenced elsewhere is then dropped and loaded again on next access.
+    """
+
+    def __init__(
+        self,
+        filename: pathlib.Path,
+        factory: Callable[[str], HsmMixin],
+        flush_count: int = 1000,
+        flush_interval_s: float = 1.0,
+    ):
+        assert isinstance(filename, pathlib.Path)
+        self._factory = factory
+        self.flush_count = flush_count
+        self.flush_interval_s = flush_interval_s
+        self._lock = threading.RLock()
+        self._machines: "weakref.WeakValueDictionary[str, HsmMixin]" = (
+            weakref.WeakValueDictionary()
+        )
+        self._recent: Dict[str, HsmMixin] = {}
+        "The machines accessed since the last flush: Keeps them loaded"
+        self._pending: Dict[str, str] = {}
+        "key -> 'full_name' of the state, not yet written"
+        self._time_flushed = time.monotonic()
+        self._connection = sqlite3.connect(str(filename), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS hsm_state (key TEXT PRIMARY KEY, state TEXT NOT NULL)"
+        )
+        self._connection.commit()
+
+    def __enter__(self) -> "HsmStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __contains__(self, key: str) -> bool:
+        return self._load_state(key) is not None
+
+    def _load_state(self, key: str) -> str:
+        with self._lock:
+            state = self._pending.get(key, None)
+            if state is not None:
+                return state
+            row = self._connection.execute(
+                "SELECT state FROM hsm_state WHERE key=?", (key,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def _record(self, key: str, state: HsmState) -> None:
+        with self._lock:
+            self._pending[key] = state.full_name
+            if len(self._pending) >= self.flush_count:
+                self.flush()
+            elif time.monotonic() - self._time_flushed >= self.flush_interval_s:
+                self.flush()
+
+    def add(self, key: str, machine: HsmMixin) -> None:
+        """
+        Add a machine, 'init()' has to be called before.
+        """
+        machine.assert_initialized()
+        with self._lock:
+            assert key not in self._machines, f"Key '{key}' already exists!"
+            machine.add_logger(_HsmStoreLogger(store=self, key=key))
+            self._machines[key] = machine
+            self._recent[key] = machine
+            self._record(key=key, state=machine.get_state())
+
+    def get(self, key: str) -> HsmMixin:
+        """
+        Return the machine, load it on first access.
+        A machine which is not in the store yet is created and 'init()' is called.
+        """
+        machine = self._machines.get(key, None)
+        if machine is not None:
+            self._recent[key] = machine
+            return machine
+        with self._lock:
+            machine = self._machines.get(key, None)
+            if machine is not None:
+                self._recent[key] = machine
+                return machine
+            machine = self._factory(key)
+            state = self._load_state(key)
+            if state is None:
+                machine.init()
+                self._record(key=key, state=machine.get_state())
+            else:
+                machine.restore(state)
+            machine.add_logger(_HsmStoreLogger(store=self, key=key))
+            self._machines[key] = machine
+            self._recent[key] = machine
+            return machine
+
+    def dispatch(self, key: str, signal: SignalType) -> None:
+        self.get(key).dispatch(signal)
+
+    def flush(self) -> int:
+        """
+        Write the pending states in one transaction.
+        Return the number of states written.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._recent = {}
+            self._time_flushed = time.monotonic()
+            if len(pending) == 0:
+                return 0
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO hsm_state (key, state) VALUES (?, ?)",
+                    pending.items(),
+                )
+            return len(pending)
+
+    def close(self) -> None:
+        """
+        Flush and detach the loggers from the machines.
+        """
+        with self._lock:
+            self.flush()
+            for machine in list(self._machines.values()):
+                for logger in machine._loggers:
+                    if isinstance(logger, _HsmStoreLogger) and logger._store is self:
+                        machine.remove_logger(logger)
+            self._machines.clear()
+            self._connection.close()
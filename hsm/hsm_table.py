@@ -0,0 +1,181 @@
+import array
+from typing import Dict, List, Optional, Set
+
+from hsm.hsm import (
+    _LOCK_TOPOLOGY,
+    BadStatemachineException,
+    HsmMixin,
+    HsmState,
+    HsmTopology,
+    SignalType,
+    _not_handled,
+    _TransitionPlan,
+)
+
+UNHANDLED = -1
+"Entry in 'HsmTable.next_state': No state handles this signal"
+
+
+class HsmTable:
+    """
+    The transitions of a purely declarative statemachine as arrays.
+
+    Every signal has to be declared by '@hsm.on(signal, to=...)', the state
+    handlers are never called. The signals are interned to dense ids
+    'signal_id' and the table is indexed by 'state_id * count_signals + signal_id':
+
+    * 'next_state[cell]': The 'state_id' after the signal, 'UNHANDLED' if no state handles the signal.
+    * 'plans[cell]': The plan if exit/entry-actions have to be called, else None.
+    """
+
+    def __init__(self, topology: HsmTopology):
+        self.topology = topology
+        signals: Set[SignalType] = set()
+        for state in topology.states:
+            if state.signals is not None:
+                signals.update(state.signals)
+        self.signals: List[SignalType] = sorted(signals, key=repr)
+        "signal_id -> signal"
+        self.signal_ids: Dict[SignalType, int] = {
+            signal: signal_id for signal_id, signal in enumerate(self.signals)
+        }
+        "signal -> signal_id"
+        self.count_signals = len(self.signals)
+        count_cells = len(topology.states) * self.count_signals
+        self.next_state = array.array("i", [UNHANDLED]) * count_cells
+        self.plans: List[Optional[_TransitionPlan]] = [None] * count_cells
+        self._compile()
+
+    def _compile(self) -> None:
+        for state in self.topology.states:
+            if state.fn_state is None:
+                # The top state is never the actual state
+                continue
+            for signal_id, signal in enumerate(self.signals):
+                result = self._declared_result(state=state, signal=signal)
+                if result is None:
+                    continue
+                cell = state.state_id * self.count_signals + signal_id
+                if result.__class__ is not HsmState:
+                    # HANDLED or IGNORED
+                    self.next_state[cell] = state.state_id
+                    continue
+                plan = state.get_plan(result)
+                self.next_state[cell] = plan.state_after.state_id
+                if len(plan.actions) > 0:
+                    self.plans[cell] = plan
+
+    @staticmethod
+    def _declared_result(state: HsmState, signal: SignalType) -> Optional[object]:
+        """
+        Return the result declared for this signal: A 'HsmState', 'HANDLED' or 'IGNORED'.
+        Return None if no state handles the signal.
+        """
+        for handling_state in state.handler_chain(signal):
+            results = handling_state.signal_results
+            if results is None or signal not in results:
+                raise BadStatemachineException(
+                    f"'{handling_state.fn_state.__name__}()' handles {signal!r} in the state handler: Use '@hsm.on({signal!r}, to=...)'!"
+                )
+            return results[signal]
+        return None
+
+    def signal_id(self, signal: SignalType) -> int:
+        return self.signal_ids[signal]
+
+
+class HsmTableMixin(HsmMixin):
+    """
+    A purely declarative statemachine: 'dispatch_id()' looks up the
+    transition in the 'HsmTable' of the class.
+    The actual state is stored as 'state_id'.
+
+    'dispatch()' and all other methods of 'HsmMixin' may still be used.
+    """
+
+    _hsm_table: HsmTable
+    "Set by 'hsm_table()' in the '__dict__' of the class which owns the table"
+    _state_id: int = None
+    _table: HsmTable = None
+
+    @property
+    def _state_actual(self) -> HsmState:
+        if self._state_id is None:
+            return None
+        return self._table.topology.states[self._state_id]
+
+    @_state_actual.setter
+    def _state_actual(self, state: HsmState) -> None:
+        if self._table is None:
+            # Set by 'restore()' or 'hsm_unpack()' without 'init()'
+            self._table = self.hsm_table()
+        self._state_id = state.state_id
+
+    @classmethod
+    def hsm_table(cls) -> HsmTable:
+        """
+        Return the table of this class.
+        The table is compiled on first use and then shared by all instances.
+        """
+        topology = cls.hsm_topology()
+        table = cls.__dict__.get("_hsm_table", None)
+        if table is not None:
+            return table
+        with _LOCK_TOPOLOGY:
+            table = cls.__dict__.get("_hsm_table", None)
+            if table is None:
+                table = HsmTable(topology)
+                cls._hsm_table = table
+            return table
+
+    @classmethod
+    def hsm_signal_id(cls, signal: SignalType) -> int:
+        """
+        Return the id of the signal as required by 'dispatch_id()'.
+        """
+        return cls.hsm_table().signal_id(signal)
+
+    def init(self):
+        self._table = self.hsm_table()
+        super().init()
+
+    def dispatch_id(self, signal_id: int) -> None:
+        """
+        Same as 'dispatch(signal)' but for the id of the signal, see 'hsm_signal_id()'.
+        Requires 'init()'.
+        """
+        table = self._table
+        # Checked in production mode too: A wrong id would read the row of another state
+        if not 0 <= signal_id < table.count_signals:
+            raise ValueError(
+                f"signal_id {signal_id} is out of range: {table.count_signals} signals!"
+            )
+        if self._loggers or self._dispatching or self._mailbox:
+            self.dispatch(table.signals[signal_id])
+            return
+
+        cell = self._state_id * table.count_signals + signal_id
+        state_id = table.next_state[cell]
+        if state_id == UNHANDLED:
+            raise _not_handled(
+                signal=table.signals[signal_id],
+                state=table.topology.states[self._state_id],
+            )
+        self._state_id = state_id
+
+        plan = table.plans[cell]
+        if plan is not None:
+            self._call_table_plan(signal=table.signals[signal_id], plan=plan)
+
+    def _call_table_plan(self, signal: SignalType, plan: _TransitionPlan) -> None:
+        """
+        Call the exit/entry-actions, the new state is already set.
+        """
+        self._dispatching = True
+        try:
+            for fn in plan.actions:
+                fn(self, signal)
+            if self._mailbox:
+                self._drain_mailbox()
+        finally:
+            self._dispatching = False
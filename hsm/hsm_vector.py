@@ -0,0 +1,108 @@
+import dataclasses
+from typing import Sequence, Union
+
+import numpy as np
+
+from hsm.hsm_table import UNHANDLED, HsmTableMixin
+
+
+@dataclasses.dataclass(frozen=True)
+class HsmVectorStep:
+    """
+    The result of 'HsmVector.step()', one entry per machine.
+    """
+
+    cells: np.ndarray
+    "The cells in 'HsmTable'"
+    signal_ids: np.ndarray
+    actions: np.ndarray
+    "True if the machine has to call exit/entry-actions, see 'HsmVector.call_actions()'"
+    unhandled: np.ndarray
+    "True if the signal was not handled: The state did not change"
+
+
+class HsmVector:
+    """
+    A population of machines of the same 'HsmTableMixin' class, stored as
+    a numpy array of 'state_id's.
+    'step()' processes one signal per machine with a single vectorized lookup.
+
+    Requires numpy.
+    """
+
+    def __init__(self, cls: type, count: int):
+        assert issubclass(cls, HsmTableMixin)
+        self.cls = cls
+        self.table = cls.hsm_table()
+        self._next_state = np.array(self.table.next_state, dtype=np.int32)
+        self._has_actions = np.array(
+            [plan is not None for plan in self.table.plans], dtype=np.bool_
+        )
+        self.state_ids: np.ndarray = np.full(
+            count, self.table.topology.init_state.state_id, dtype=np.int32
+        )
+
+    def __len__(self) -> int:
+        return len(self.state_ids)
+
+    def load(self, machines: Sequence[HsmTableMixin]) -> None:
+        """
+        Copy the states of the machines into 'state_ids'.
+        """
+        assert len(machines) == len(self.state_ids)
+        self.state_ids[:] = [machine._state_id for machine in machines]
+
+    def store(self, machines: Sequence[HsmTableMixin]) -> None:
+        """
+        Copy 'state_ids' into the machines.
+        """
+        assert len(machines) == len(self.state_ids)
+        for machine, state_id in zip(machines, self.state_ids.tolist()):
+            machine._state_id = state_id
+
+    def step(self, signal_ids: Union[int, np.ndarray]) -> HsmVectorStep:
+        """
+        Process one signal per machine: 'signal_ids' is an array with one
+        'signal_id' per machine or a single 'signal_id' for all machines.
+
+        The exit/entry-actions are NOT called: Use 'call_actions()' for
+        the machines in 'HsmVectorStep.actions'.
+        """
+        signal_ids_all: np.ndarray = np.broadcast_to(
+            np.asarray(signal_ids, dtype=np.int64), self.state_ids.shape
+        )
+        count_signals = self.table.count_signals
+        if (signal_ids_all.min() < 0) or (signal_ids_all.max() >= count_signals):
+            # numpy would wrap negative ids and read the row of another state
+            raise ValueError(f"A signal_id is out of range: {count_signals} signals!")
+        cells: np.ndarray = self.state_ids * self.table.count_signals + signal_ids_all
+        next_state = self._next_state[cells]
+        unhandled = next_state == UNHANDLED
+        self.state_ids = np.where(unhandled, self.state_ids, next_state)
+        return HsmVectorStep(
+            cells=cells,
+            signal_ids=signal_ids_all,
+            actions=self._has_actions[cells],
+            unhandled=unhandled,
+        )
+
+    def call_actions(
+        self, step: HsmVectorStep, machines: Sequence[HsmTableMixin]
+    ) -> int:
+        """
+        Call the exit/entry-actions for the machines in 'step.actions'.
+        'machines[i]' has to correspond to 'state_ids[i]'.
+        Signals dispatched by the actions are processed too.
+        Return the number of machines which called actions.
+        """
+        table = self.table
+        indices = np.flatnonzero(step.actions).tolist()
+        for index in indices:
+            machine = machines[index]
+            machine._state_id = int(self.state_ids[index])
+            machine._call_table_plan(
+                signal=table.signals[step.signal_ids[index]],
+                plan=table.plans[step.cells[index]],
+            )
+            self.state_ids[index] = machine._state_id
+        return len(indices)
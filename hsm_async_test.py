@@ -0,0 +1,203 @@
+import asyncio
+
+from hsm import hsm
+from hsm.hsm import HsmStringIoLogger, StateChangeException
+from hsm.hsm_async import AsyncHsmMixin
+
+SignalType = str
+
+
+class UnderTest(AsyncHsmMixin):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.events = []
+
+    @hsm.init_state
+    def state_TopA(self, signal: SignalType):
+        if signal == "a":
+            raise StateChangeException(self.state_TopB)
+        return hsm.HANDLED
+
+    async def state_TopB(self, signal: SignalType):
+        if signal == "b":
+            await asyncio.sleep(0)
+            return self.hsm_states.state_TopA
+        if signal == "p":
+            self.post("b")
+        if signal == "boom":
+            raise ValueError("boom")
+        return hsm.HANDLED
+
+    async def state_TopB_SubA(self, signal: SignalType):
+        return None
+
+    async def entry_TopB(self, signal: SignalType):
+        await asyncio.sleep(0)
+        self.events.append("entry_TopB")
+        # Will be processed after the transition to TopB has been completed
+        await self.dispatch("p")
+
+    def exit_TopB(self, signal: SignalType):
+        self.events.append("exit_TopB")
+
+
+def test_async_dispatch():
+    async def run():
+        logger = HsmStringIoLogger()
+        sm = UnderTest(hsm_logger=logger)
+        sm.init()
+        await sm.dispatch("a")
+        logger.assert_equal(
+            """
+                'a': will be handled by TopA
+                >   calling state "state_TopA(a)"
+                > a: was handled by state_TopA
+                >   Init-State for TopB is TopB_SubA.
+                >   Calling entry_TopB
+                >>> TopA ==>entry_TopB==> TopB_SubA
+                'p': will be handled by TopB_SubA
+                >   calling state "state_TopB_SubA(p)"
+                >   No state change!
+                'b': will be handled by TopB_SubA
+                >   calling state "state_TopB_SubA(b)"
+                > b: was handled by state_TopB
+                >   Calling exit_TopB
+                >>> TopB_SubA ==>exit_TopB==> TopA
+            """
+        )
+        assert sm.events == ["entry_TopB", "exit_TopB"]
+        assert sm.is_state(sm.state_TopA)
+
+    asyncio.run(run())
+
+
+def test_async_dispatch_fifo():
+    async def run():
+        logger = HsmStringIoLogger()
+        logger.log_events = hsm.HsmLogEvent.INFO
+        sm = UnderTest(hsm_logger=logger)
+        sm.init()
+        # The signal posted before is processed first
+        sm.post("a")
+        await sm.dispatch("x")
+        logger.assert_equal(
+            """
+                'a': will be handled by TopA
+                'x': will be handled by TopB_SubA
+                'p': will be handled by TopB_SubA
+                'b': will be handled by TopB_SubA
+            """
+        )
+        assert sm.is_state(sm.state_TopA)
+
+    asyncio.run(run())
+
+
+def test_async_mailbox():
+    async def run():
+        machines = [UnderTest() for _ in range(10)]
+        for sm in machines:
+            sm.init()
+            sm.start_mailbox()
+        for sm in machines:
+            sm.post("a")
+        for sm in machines:
+            await sm.join()
+            assert sm.is_state(sm.state_TopA)
+            assert sm.events == ["entry_TopB", "exit_TopB"]
+            await sm.stop_mailbox()
+
+        sm = machines[0]
+        sm.post("a")
+        sm.post("x")
+        assert await sm.drain() == 4
+        assert sm.is_state(sm.state_TopA)
+
+    asyncio.run(run())
+
+
+def test_async_mailbox_error():
+    async def run():
+        sm = UnderTest()
+        sm.init()
+        errors = []
+        sm.start_mailbox(on_error=lambda signal, e: errors.append((signal, str(e))))
+        sm.post("a")
+        sm.post("boom")
+        await sm.join()
+        assert errors == [("boom", "boom")]
+
+        # The mailbox task is still running
+        sm.post("b")
+        await sm.join()
+        assert sm.is_state(sm.state_TopA)
+        await sm.stop_mailbox()
+
+        sm.post("a")
+        try:
+            await sm.join()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Expected RuntimeError")
+        assert await sm.drain() == 3
+
+        sm.start_mailbox()
+        sm.post("a")
+        sm.post("boom")
+        await sm.join()
+        assert [signal for signal, _ in sm.mailbox_errors] == ["boom"]
+        await sm.stop_mailbox()
+
+    asyncio.run(run())
+
+
+def test_async_restore():
+    async def run():
+        sm = UnderTest()
+        try:
+            sm.restore("TopB_SubA", entry_actions=True)
+        except AssertionError as e:
+            assert "Use 'await start()'" in str(e)
+        else:
+            raise AssertionError("Expected AssertionError")
+
+        sm.restore("TopB_SubA")
+        assert sm.events == []
+        await sm.start()
+        assert sm.events == ["entry_TopB", "exit_TopB"]
+        assert sm.is_state(sm.state_TopA)
+
+    asyncio.run(run())
+
+
+def test_async_dispatch_error():
+    class Failing(AsyncHsmMixin):
+        @hsm.init_state
+        async def state_TopA(self, signal: SignalType):
+            if signal == "boom":
+                self.post("a")
+                raise ValueError("boom")
+            if signal == "a":
+                return self.hsm_states.state_TopB
+            return hsm.HANDLED
+
+        def state_TopB(self, signal: SignalType):
+            return hsm.HANDLED
+
+    async def run():
+        sm = Failing()
+        sm.init()
+        try:
+            await sm.dispatch("boom")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Expected ValueError")
+
+        # The signals posted by a failing step stay posted
+        assert sm.is_state(sm.state_TopA)
+        assert await sm.drain() == 1
+        assert sm.is_state(sm.state_TopB)
+
+    asyncio.run(run())
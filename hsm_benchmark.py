@@ -0,0 +1,307 @@
+"""
+Benchmarks for the hierarchical statemachine.
+
+Usage: python hsm_benchmark.py [--json results.json]
+"""
+
+import argparse
+import collections
+import dataclasses
+import json
+import pathlib
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from hsm import hsm
+from hsm.hsm_executor import HsmExecutor
+from hsm_testing import SIGNAL_JUMP, SIGNAL_LEAF, SIGNAL_TOP, make_machine
+
+
+def make_signals(
+    count: int, distribution: Dict[str, float], seed: int = 0
+) -> List[str]:
+    """
+    Return 'count' signals drawn from 'distribution': signal -> weight.
+    """
+    rnd = random.Random(seed)
+    return rnd.choices(
+        list(distribution.keys()), weights=list(distribution.values()), k=count
+    )
+
+
+def _best_duration(fn: Callable[[], Any], repeat: int = 3) -> float:
+    """
+    Return the duration of the fastest of 'repeat' calls in s.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+@dataclasses.dataclass(eq=False)
+class _LegacyHsmState:
+    """
+    The memory layout of 'HsmState' before it was slot based.
+    Only used as reference by 'bench_memory()'.
+    """
+
+    hsm: Any = None
+    name: str = None
+    outer_state: Any = None
+    fn_state: Any = None
+    fn_entry: Any = None
+    fn_exit: Any = None
+    init_state: Any = None
+    substates: Dict[str, Any] = dataclasses.field(
+        default_factory=collections.OrderedDict
+    )
+    transitions_from: List[Any] = dataclasses.field(default_factory=list)
+    transitions_to: List[Any] = dataclasses.field(default_factory=list)
+    exit_when: str = None
+
+
+def _sizeof_legacy_state(state: _LegacyHsmState) -> int:
+    return (
+        sys.getsizeof(state)
+        + sys.getsizeof(state.__dict__)
+        + sys.getsizeof(state.substates)
+        + sys.getsizeof(state.transitions_from)
+        + sys.getsizeof(state.transitions_to)
+    )
+
+
+def _sizeof_state(state: hsm.HsmState) -> int:
+    size = sys.getsizeof(state) + sys.getsizeof(state.path)
+    size += sys.getsizeof(state.full_name)
+    if len(state.substates) > 0:
+        size += sys.getsizeof(state.substates)
+    return size
+
+
+def bench_memory(depth: int = 3, fanout: int = 4) -> Dict[str, Any]:
+    """
+    Bytes per state node: The legacy dataclass layout versus the slot based 'HsmState'.
+    """
+    cls = make_machine(depth=depth, fanout=fanout)
+    topology = cls.hsm_topology()
+
+    legacy_states: Dict[hsm.HsmState, _LegacyHsmState] = {}
+    for state in topology.states:
+        legacy_state = _LegacyHsmState(
+            name=state.name,
+            outer_state=legacy_states.get(state.outer_state, None),
+            fn_state=state.fn_state,
+        )
+        legacy_states[state] = legacy_state
+        if legacy_state.outer_state is not None:
+            legacy_state.outer_state.substates[state.name] = legacy_state
+
+    count = len(topology.states)
+    bytes_before = sum(_sizeof_legacy_state(s) for s in legacy_states.values())
+    bytes_after = sum(_sizeof_state(s) for s in topology.states)
+
+    sm = cls()
+    sm.init()
+    bytes_instance = sys.getsizeof(sm) + sys.getsizeof(sm.__dict__)
+
+    return {
+        "benchmark": "memory",
+        "depth": depth,
+        "fanout": fanout,
+        "states": count,
+        "bytes_per_state_before": bytes_before // count,
+        "bytes_per_state_after": bytes_after // count,
+        "bytes_per_instance": bytes_instance,
+    }
+
+
+def bench_machine(
+    depth: int,
+    fanout: int,
+    action_density: float = 0.5,
+    distribution: Dict[str, float] = None,
+    count: int = 10000,
+) -> List[Dict[str, Any]]:
+    """
+    init(), dispatch(), is_state(), mermaid rendering and memory
+    of a generated machine.
+    """
+    if distribution is None:
+        distribution = {SIGNAL_LEAF: 0.8, SIGNAL_TOP: 0.15, SIGNAL_JUMP: 0.05}
+    parameters = {
+        "depth": depth,
+        "fanout": fanout,
+        "action_density": action_density,
+    }
+    results: List[Dict[str, Any]] = []
+
+    def add(benchmark: str, **values: Any) -> None:
+        results.append({"benchmark": benchmark, **parameters, **values})
+
+    # Compile the topology of a fresh class
+    start = time.perf_counter()
+    cls = make_machine(depth=depth, fanout=fanout, action_density=action_density)
+    cls.hsm_topology()
+    add(
+        "compile",
+        states=len(cls.hsm_topology().states),
+        duration_ms=(time.perf_counter() - start) * 1000.0,
+    )
+
+    def init_instances() -> None:
+        for _ in range(count):
+            cls().init()
+
+    add("init", per_s=int(count / _best_duration(init_instances)))
+
+    sm = cls()
+    sm.init()
+
+    def dispatch_signals(signals: List[str]) -> Callable[[], None]:
+        def fn() -> None:
+            for signal in signals:
+                sm.dispatch(signal)
+
+        return fn
+
+    for benchmark, signal in (
+        ("dispatch_leaf", SIGNAL_LEAF),
+        ("dispatch_top", SIGNAL_TOP),
+        ("transition_lca", SIGNAL_JUMP),
+    ):
+        duration = _best_duration(dispatch_signals([signal] * count))
+        add(benchmark, signals_per_s=int(count / duration))
+
+    signals = make_signals(count=count, distribution=distribution)
+    duration = _best_duration(dispatch_signals(signals))
+    add("dispatch_mix", distribution=distribution, signals_per_s=int(count / duration))
+
+    state = sm.state_S0
+
+    def is_state() -> None:
+        for _ in range(count):
+            sm.is_state(state)
+
+    add("is_state", calls_per_s=int(count / _best_duration(is_state)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = pathlib.Path(directory) / "machine.md"
+        topology = cls.hsm_topology()
+
+        def write_mermaid() -> None:
+            # The diagram is cached by the topology: Measure building it every run
+            topology._diagram = None
+            sm.write_mermaid_md(filename)
+
+        duration = _best_duration(write_mermaid)
+        add("mermaid", duration_ms=duration * 1000.0)
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    instances = [cls() for _ in range(count)]
+    for instance in instances:
+        instance.init()
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(
+        stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename")
+    )
+    add("memory_instance", bytes_per_instance=size // count)
+    return results
+
+
+class _Toggle(hsm.HsmMixin):
+    @hsm.init_state
+    def state_A(self, signal: Any):
+        return self.hsm_states.state_B
+
+    def state_B(self, signal: Any):
+        return self.hsm_states.state_A
+
+
+def bench_executor(
+    machines: int = 1000, signals: int = 100, max_workers: int = 8
+) -> List[Dict[str, Any]]:
+    """
+    Throughput of 'HsmExecutor' versus dispatching behind one global lock.
+    """
+    sms = [_Toggle() for _ in range(machines)]
+    for sm in sms:
+        sm.init()
+    count = machines * signals
+
+    lock = threading.Lock()
+    start = time.perf_counter()
+    for signal in range(signals):
+        for sm in sms:
+            with lock:
+                sm.dispatch(signal)
+    duration_lock = time.perf_counter() - start
+
+    with HsmExecutor(max_workers=max_workers) as executor:
+        start = time.perf_counter()
+        for signal in range(signals):
+            for sm in sms:
+                executor.post(sm, signal)
+        executor.join()
+        duration_executor = time.perf_counter() - start
+
+    return [
+        {
+            "benchmark": "global_lock",
+            "machines": machines,
+            "signals": count,
+            "signals_per_s": int(count / duration_lock),
+        },
+        {
+            "benchmark": "executor",
+            "machines": machines,
+            "signals": count,
+            "max_workers": max_workers,
+            "signals_per_s": int(count / duration_executor),
+        },
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", type=pathlib.Path, help="Write the results to this file")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=3)
+    parser.add_argument("--action-density", type=float, default=0.5)
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+
+    results = [bench_memory()]
+    results.extend(
+        bench_machine(
+            depth=args.depth,
+            fanout=args.fanout,
+            action_density=args.action_density,
+            count=args.count,
+        )
+    )
+    results.extend(bench_executor())
+    for result in results:
+        print(result)
+    if args.json is not None:
+        report = {
+            "version": hsm.__version__,
+            "python": sys.version,
+            "platform": platform.platform(),
+            "results": results,
+        }
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import importlib.util
+import pathlib
+
+import pytest
+
+from hsm import hsm
+from hsm.hsm import BadStatemachineException, HsmMixin
+from hsm.hsm_codegen import generate, verify, write_module
+
+SignalType = str
+
+SIGNALS = ("a", "b", "c", "d", "g", "h", "i", "p", "x", "z")
+
+
+class UnderTest(HsmMixin):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    @hsm.init_state
+    def state_TopA(self, signal: SignalType):
+        if signal == "c":
+            raise hsm.StateChangeException(self.state_TopA_SubA, why="c")
+        if signal == "x":
+            return self.hsm_states.state_TopA
+        return None
+
+    @hsm.init_state
+    def state_TopA_SubA(self, signal: SignalType):
+        if signal == "b":
+            return self.hsm_states.state_TopA_SubA_Y
+        if signal == "p":
+            self.post("h")
+            return hsm.HANDLED
+        if signal == "g":
+            # Not found by the generator: Not unrolled
+            return getattr(self, "state_" + "TopB")
+        return None
+
+    @hsm.init_state
+    def state_TopA_SubA_X(self, signal: SignalType):
+        if signal == "a":
+            return self.state_TopA_SubB
+        if signal == "h":
+            return hsm.HANDLED
+        if signal == "i":
+            raise hsm.IgnoreEventException(why="i")
+        return None
+
+    def state_TopA_SubA_Y(self, signal: SignalType):
+        if signal == "a":
+            return hsm.Transition(self.hsm_states.state_TopB, why="a")
+        if signal == "d":
+            raise hsm.DontChangeStateException()
+        return None
+
+    def state_TopA_SubB(self, signal: SignalType):
+        if signal in ("a", "h"):
+            return self.hsm_states.state_TopA_SubA_X
+        return hsm.IGNORED if signal == "i" else None
+
+    def state_TopB(self, signal: SignalType):
+        if signal == "z":
+            return None
+        return self.hsm_states.state_TopA
+
+    def entry_TopA(self, signal: SignalType):
+        self.calls.append(("entry_TopA", signal))
+
+    def exit_TopA(self, signal: SignalType):
+        self.calls.append(("exit_TopA", signal))
+
+    def entry_TopA_SubA_Y(self, signal: SignalType):
+        self.calls.append(("entry_TopA_SubA_Y", signal))
+
+    def exit_TopA_SubA_X(self, signal: SignalType):
+        self.calls.append(("exit_TopA_SubA_X", signal))
+
+    def entry_TopB(self, signal: SignalType):
+        self.calls.append(("entry_TopB", signal))
+        self.post("h")
+
+
+class UnderTestOn(HsmMixin):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    @hsm.init_state
+    @hsm.on("a", to="state_Frame")
+    @hsm.on("h", to=hsm.HANDLED)
+    def state_Idle(self, signal: SignalType):
+        return None
+
+    @hsm.on("z", to="state_Idle")
+    @hsm.on("b", "c")
+    def state_Frame(self, signal: SignalType):
+        if signal == "b":
+            return self.hsm_states.state_Frame_Escape
+        raise hsm.IgnoreEventException()
+
+    @hsm.init_state
+    @hsm.on("h", to=hsm.HANDLED)
+    def state_Frame_Data(self, signal: SignalType):
+        return None
+
+    @hsm.on("a", to="state_Frame_Data")
+    def state_Frame_Escape(self, signal: SignalType):
+        return None
+
+    def entry_Frame(self, signal: SignalType):
+        self.calls.append(("entry_Frame", signal))
+
+    def exit_Frame(self, signal: SignalType):
+        self.calls.append(("exit_Frame", signal))
+
+    def entry_Frame_Escape(self, signal: SignalType):
+        self.calls.append(("entry_Frame_Escape", signal))
+
+
+class Variant(HsmMixin):
+    @hsm.init_state
+    @hsm.on("a", to="state_B")
+    def state_A(self, signal: SignalType):
+        return None
+
+    def state_B(self, signal: SignalType):
+        return None
+
+    @hsm.init_state
+    def state_B_X(self, signal: SignalType):
+        return None
+
+    def state_B_Y(self, signal: SignalType):
+        return None
+
+
+class VariantInitState(Variant):
+    def state_B_X(self, signal: SignalType):
+        return None
+
+    @hsm.init_state
+    def state_B_Y(self, signal: SignalType):
+        return None
+
+
+class VariantSignals(Variant):
+    @hsm.init_state
+    @hsm.on("a", to="state_B")
+    @hsm.on("b", to=hsm.HANDLED)
+    def state_A(self, signal: SignalType):
+        return None
+
+
+class VariantTarget(Variant):
+    @hsm.init_state
+    @hsm.on("a", to="state_B_Y")
+    def state_A(self, signal: SignalType):
+        return None
+
+
+def _import(cls: type, directory: pathlib.Path):
+    filename = directory / f"{cls.__name__}_dispatch.py"
+    write_module(cls, filename)
+    spec = importlib.util.spec_from_file_location(filename.stem, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _factory(cls: type):
+    def factory():
+        sm = cls()
+        sm.init()
+        return sm
+
+    return factory
+
+
+def _take_calls(sm: HsmMixin):
+    calls = tuple(sm.calls)
+    sm.calls.clear()
+    return calls
+
+
+@pytest.mark.parametrize("cls", [UnderTest, UnderTestOn])
+@pytest.mark.parametrize("seed", range(3))
+def test_differential(cls: type, seed: int, tmp_path: pathlib.Path):
+    module = _import(cls, tmp_path)
+    verify(
+        factory=_factory(cls),
+        dispatch=module.dispatch,
+        signals=SIGNALS,
+        count=3000,
+        seed=seed,
+        observe=_take_calls,
+    )
+
+
+def test_generated(tmp_path: pathlib.Path):
+    source = generate(UnderTest)
+    assert "def _dispatch_TopA_SubA_X(self, signal):" in source
+    assert "def _dispatch_TopA_SubA(" not in source
+    # The transition from 'TopA_SubA_Y' to 'TopB' is unrolled
+    assert "    self._state_actual = _S6\n    _x1(self, signal)\n    _n6(self, signal)\n" in source
+    assert "_dispatch_TopA_SubA_Y__transitions = {_S6: _t3, " in source
+
+    module = _import(UnderTest, tmp_path)
+    sm = UnderTest()
+    sm.init()
+    module.dispatch(sm, "b")
+    module.dispatch(sm, "a")
+    assert sm.calls == [
+        ("exit_TopA_SubA_X", "b"),
+        ("entry_TopA_SubA_Y", "b"),
+        ("exit_TopA", "a"),
+        ("entry_TopB", "a"),
+        ("entry_TopA", "h"),
+    ]
+    assert sm.get_state() is UnderTest.hsm_states.state_TopA_SubA_X
+
+    with pytest.raises(Exception, match="Signal z was not handled by state_TopA!"):
+        module.dispatch(sm, "z")
+
+
+def test_module_level_only():
+    class Inner(HsmMixin):
+        def state_TopA(self, signal: SignalType):
+            return None
+
+    with pytest.raises(BadStatemachineException, match="Only classes defined at module level"):
+        generate(Inner)
+
+
+def test_verify_detects_difference():
+    def dispatch(sm: HsmMixin, signal: SignalType):
+        if signal != "b":
+            sm.dispatch(signal)
+
+    with pytest.raises(AssertionError, match="Signal .* 'b'"):
+        verify(factory=_factory(UnderTest), dispatch=dispatch, signals=SIGNALS, count=1000)
+
+
+@pytest.mark.parametrize("cls", [VariantInitState, VariantSignals, VariantTarget])
+def test_stale_module(cls: type, tmp_path: pathlib.Path):
+    # A module generated for 'Variant' is imported for a changed class
+    filename = tmp_path / "stale_dispatch.py"
+    source = generate(Variant)
+    filename.write_text(
+        source.replace(
+            "from hsm_codegen_test import Variant as _cls",
+            f"from hsm_codegen_test import {cls.__name__} as _cls",
+        )
+    )
+    spec = importlib.util.spec_from_file_location(filename.stem, filename)
+    module = importlib.util.module_from_spec(spec)
+    with pytest.raises(BadStatemachineException, match="has changed"):
+        spec.loader.exec_module(module)
+
+    module = _import(Variant, tmp_path)
+    sm = Variant()
+    sm.init()
+    module.dispatch(sm, "a")
+    assert sm.get_state() is Variant.hsm_states.state_B_X
@@ -0,0 +1,93 @@
+import json
+import sys
+
+from hsm import hsm
+from hsm.hsm import HsmMixin
+from hsm_testing import make_machine
+
+SignalType = str
+
+
+class UnderTest(HsmMixin):
+    @hsm.init_state
+    def state_TopA(self, signal: SignalType):
+        """
+        TRANSITION state_TopB_SubA signal == "b"
+        """
+        return self.hsm_states.state_TopB
+
+    def state_TopB(self, signal: SignalType):
+        """
+        EXIT signal == "x"
+        """
+        return self.hsm_states.state_TopA
+
+    @hsm.init_state
+    def state_TopB_SubA(self, signal: SignalType):
+        raise hsm.DontChangeStateException()
+
+    def entry_TopB(self, signal: SignalType):
+        "Switch on"
+
+
+def test_cache():
+    sm = UnderTest()
+    sm.init()
+    diagram = UnderTest.hsm_topology().diagram()
+    text = sm.render_diagram()
+    assert sm.render_diagram() is not text
+    assert diagram._cache[("mermaid", True, True)][0] in text
+    assert text.startswith("```mermaid\nstateDiagram-v2\n")
+    assert text.endswith("```\n")
+    assert "TopA --> TopB_SubA: signal == \"b\"" in text
+
+    # The overlay does not render again
+    text_current = sm.render_diagram(highlight_current=True)
+    assert len(diagram._cache) == 1
+    assert "    class TopA hsm_current\n```\n" in text_current
+
+
+def test_dot():
+    sm = UnderTest()
+    sm.init()
+    text = sm.render_diagram(fmt="dot")
+    assert text.startswith("digraph hsm {\n")
+    assert text.endswith("}\n")
+    assert 'subgraph "cluster_TopB" {' in text
+    assert '"__init" -> "TopA";' in text
+    assert '"TopB__init" -> "TopB_SubA";' in text
+    assert '"TopA" -> "TopB_SubA" [label="signal == \\"b\\""];' in text
+    assert '"TopB_SubA" -> "TopB__exit" [ltail="cluster_TopB", label="signal == \\"x\\""];' in text
+    assert "entry_TopB()" in text
+
+    text_current = sm.render_diagram(fmt="dot", highlight_current=True)
+    assert text_current.endswith('"TopA" [style="rounded,filled", fillcolor="#ff9966"];\n}\n')
+
+
+def test_json():
+    sm = UnderTest()
+    sm.init()
+    graph = json.loads(sm.render_diagram(fmt="json"))
+    assert graph["init"] == "TopA"
+    states = {state["full_name"]: state for state in graph["states"]}
+    assert list(states) == ["TopA", "TopB", "TopB_SubA"]
+    assert states["TopB"]["init"] == "TopB_SubA"
+    assert states["TopB"]["entry"] == "Switch on"
+    assert states["TopB"]["exit_when"] == 'signal == "x"'
+    assert graph["transitions"] == [
+        {"from": "TopA", "to": "TopB_SubA", "when": 'signal == "b"'}
+    ]
+
+    sm.dispatch("b")
+    graph = json.loads(sm.render_diagram(fmt="json", highlight_current=True))
+    assert graph["current"] == "TopB_SubA"
+
+
+def test_deep_machine():
+    depth = sys.getrecursionlimit() + 100
+    cls = make_machine(depth=depth, fanout=1)
+    sm = cls()
+    sm.init()
+    leaf = "_".join(["S0"] * depth)
+    for fmt in ("mermaid", "dot", "json"):
+        assert leaf in sm.render_diagram(fmt=fmt)
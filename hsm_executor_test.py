@@ -0,0 +1,91 @@
+import gc
+import weakref
+
+import pytest
+
+from hsm import hsm
+from hsm.hsm import HsmMixin
+from hsm.hsm_executor import HsmExecutor
+
+SignalType = int
+
+
+class UnderTest(HsmMixin):
+    def __init__(self, peer: "UnderTest" = None, executor: HsmExecutor = None):
+        super().__init__()
+        self.signals = []
+        self.peer = peer
+        self.executor = executor
+
+    @hsm.init_state
+    def state_Even(self, signal: SignalType):
+        self.signals.append(signal)
+        if signal < 0:
+            raise ValueError(signal)
+        if self.peer is not None:
+            self.executor.post(self.peer, signal)
+        return self.hsm_states.state_Odd
+
+    def state_Odd(self, signal: SignalType):
+        self.signals.append(signal)
+        return self.hsm_states.state_Even
+
+
+def test_executor_order():
+    count_machines = 200
+    count_signals = 50
+    with HsmExecutor(max_workers=8, batch_size=7) as executor:
+        machines = [UnderTest() for _ in range(count_machines)]
+        for sm in machines:
+            sm.init()
+        for signal in range(count_signals):
+            for sm in machines:
+                executor.post(sm, signal)
+        executor.join()
+
+        for sm in machines:
+            assert sm.signals == list(range(count_signals))
+            assert sm.is_state(sm.state_Even)
+        assert executor.errors == []
+
+
+def test_executor_post_from_handler():
+    with HsmExecutor(max_workers=4) as executor:
+        sm_b = UnderTest()
+        sm_a = UnderTest(peer=sm_b, executor=executor)
+        for sm in (sm_a, sm_b):
+            sm.init()
+        for signal in (1, 2, -3, 4, 5):
+            executor.post(sm_a, signal)
+        executor.join()
+
+        assert sm_a.signals == [1, 2, -3, 4, 5]
+        assert sm_b.signals == [1, 4]
+        assert len(executor.errors) == 1
+        assert executor.errors[0].signal == -3
+        assert executor.errors[0].machine is sm_a
+
+
+def test_executor_releases_machines():
+    with HsmExecutor(max_workers=2) as executor:
+        sm = UnderTest()
+        sm.init()
+        executor.post(sm, 1)
+        executor.join()
+        ref = weakref.ref(sm)
+        del sm
+        gc.collect()
+        assert ref() is None
+        assert len(executor._actors) == 0
+
+
+def test_executor_post_after_shutdown():
+    executor = HsmExecutor(max_workers=2)
+    sm = UnderTest()
+    sm.init()
+    executor.post(sm, 1)
+    executor.shutdown()
+    assert sm.signals == [1]
+    with pytest.raises(RuntimeError, match="The executor is shut down!"):
+        executor.post(sm, 2)
+    executor.join()
@@ -0,0 +1,99 @@
+import random
+
+from hsm import hsm
+from hsm.hsm import HsmMixin, HsmStringIoLogger
+from hsm.hsm_fleet import HsmFleet
+
+SignalType = str
+
+
+class UnderTest(HsmMixin):
+    def __init__(self, threshold: int, **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold
+        self.counter = 0
+        self.actions = []
+
+    @hsm.init_state
+    def state_Idle(self, signal: SignalType):
+        if signal == "start":
+            return self.hsm_states.state_Running
+        if signal == "tick":
+            return hsm.IGNORED
+        return hsm.HANDLED
+
+    def state_Running(self, signal: SignalType):
+        if signal == "stop":
+            return self.hsm_states.state_Idle
+        return hsm.HANDLED
+
+    @hsm.init_state
+    def state_Running_Slow(self, signal: SignalType):
+        if signal == "tick":
+            self.counter += 1
+            if self.counter >= self.threshold:
+                return self.hsm_states.state_Running_Fast
+            return hsm.HANDLED
+        return None
+
+    def state_Running_Fast(self, signal: SignalType):
+        if signal == "tick":
+            raise hsm.StateChangeException(self.state_Running_Slow)
+        return None
+
+    def entry_Running(self, signal: SignalType):
+        self.actions.append("entry_Running")
+
+    def exit_Running(self, signal: SignalType):
+        self.actions.append("exit_Running")
+
+    def entry_Running_Fast(self, signal: SignalType):
+        self.actions.append("entry_Running_Fast")
+        if self.threshold == 2:
+            self.dispatch("stop")
+
+
+def test_fleet_equals_dispatch():
+    rnd = random.Random(42)
+    signals = [rnd.choice(["start", "stop", "tick", "tick", "tick"]) for _ in range(200)]
+
+    fleet = HsmFleet(UnderTest)
+    references = []
+    for i in range(50):
+        sm = UnderTest(threshold=i % 5)
+        sm.init()
+        fleet.add(sm)
+        sm_reference = UnderTest(threshold=i % 5)
+        sm_reference.init()
+        references.append(sm_reference)
+
+    for signal in signals:
+        summary = fleet.dispatch(signal)
+        for sm_reference in references:
+            sm_reference.dispatch(signal)
+        assert summary == fleet.count_by_state()
+        assert sum(summary.values()) == len(fleet)
+
+    for sm, sm_reference in zip(fleet, references):
+        assert sm.get_state() is sm_reference.get_state()
+        assert sm.counter == sm_reference.counter
+        assert sm.actions == sm_reference.actions
+
+
+def test_fleet_logger():
+    logger = HsmStringIoLogger()
+    sm = UnderTest(threshold=1, hsm_logger=logger)
+    sm.init()
+    fleet = HsmFleet(UnderTest)
+    fleet.add(sm)
+    assert fleet.dispatch("start") == {"Running_Slow": 1}
+    logger.assert_equal(
+        """
+            'start': will be handled by Idle
+            >   calling state "state_Idle(start)"
+            > start: was handled by state_Idle
+            >   Init-State for Running is Running_Slow.
+            >   Calling entry_Running
+            >>> Idle ==>entry_Running==> Running_Slow
+        """
+    )
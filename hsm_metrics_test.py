@@ -0,0 +1,91 @@
+import threading
+
+from hsm import hsm
+from hsm.hsm import HsmMixin
+from hsm.hsm_metrics import HsmMetricsRegistry
+
+SignalType = str
+
+
+class UnderTest(HsmMixin):
+    @hsm.init_state
+    @hsm.value(0)
+    def state_Off(self, signal: SignalType):
+        return self.hsm_states.state_On
+
+    @hsm.value(1)
+    def state_On(self, signal: SignalType):
+        return self.hsm_states.state_Off
+
+
+def test_metrics():
+    registry = HsmMetricsRegistry(UnderTest)
+    machines = [UnderTest() for _ in range(3)]
+    for i, sm in enumerate(machines):
+        sm.init()
+        registry.add(sm, name=f"sm{i}")
+        for _ in range(i):
+            sm.dispatch("toggle")
+
+    metrics = registry.machines["sm2"]
+    state_on = UnderTest.hsm_states.state_On
+    state_off = UnderTest.hsm_states.state_Off
+    assert metrics.entries[state_on.state_id] == 1
+    assert metrics.entries[state_off.state_id] == 1
+    state_id, _, dwell_ns = metrics.snapshot()
+    assert state_id == state_off.state_id
+    assert dwell_ns[state_off.state_id] > 0
+
+    text = registry.scrape()
+    assert "# TYPE hsm_state_entries_total counter" in text
+    assert 'hsm_state_entries_total{class="UnderTest",state="On"} 2' in text
+    assert 'hsm_state_entries_total{class="UnderTest",state="Off"} 1' in text
+    assert 'hsm_state_machines{class="UnderTest",state="Off"} 2' in text
+    assert 'hsm_state_machines{class="UnderTest",state="On"} 1' in text
+
+    text = registry.scrape(per_machine=True)
+    assert (
+        'hsm_state_entries_total{class="UnderTest",machine="sm1",state="On"} 1' in text
+    )
+    assert 'hsm_state_value{class="UnderTest",machine="sm1"} 1' in text
+    assert 'hsm_state_value{class="UnderTest",machine="sm2"} 0' in text
+
+    # The actual state is read from the machine, also if changed without a transition
+    machines[2].force_state(machines[2].state_On)
+    text = registry.scrape()
+    assert 'hsm_state_machines{class="UnderTest",state="On"} 2' in text
+    text = registry.scrape(per_machine=True)
+    assert 'hsm_state_value{class="UnderTest",machine="sm2"} 1' in text
+
+    # The counts of a removed machine remain in the totals
+    registry.remove("sm2")
+    assert metrics not in machines[2]._loggers
+    machines[2].dispatch("toggle")
+    text = registry.scrape()
+    assert 'hsm_state_entries_total{class="UnderTest",state="On"} 2' in text
+    assert 'hsm_state_machines{class="UnderTest",state="On"} 1' in text
+    assert registry.entries[state_on.state_id] == 1
+
+
+def test_metrics_threads():
+    # No counters are shared: Concurrent transitions of different machines lose no counts
+    registry = HsmMetricsRegistry(UnderTest)
+    machines = [UnderTest() for _ in range(4)]
+    for i, sm in enumerate(machines):
+        sm.init()
+        registry.add(sm, name=f"sm{i}")
+
+    def toggle(sm: UnderTest) -> None:
+        for _ in range(10_000):
+            sm.dispatch("toggle")
+
+    threads = [threading.Thread(target=toggle, args=(sm,)) for sm in machines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    registry.remove("sm0")
+    text = registry.scrape()
+    assert 'hsm_state_entries_total{class="UnderTest",state="On"} 20000' in text
+    assert 'hsm_state_entries_total{class="UnderTest",state="Off"} 20000' in text
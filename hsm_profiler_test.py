@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from hsm import hsm
+from hsm.hsm import HsmMixin, HsmStringIoLogger
+from hsm.hsm_async import AsyncHsmMixin
+from hsm.hsm_profiler import HsmHistogram, HsmProfiler
+
+SignalType = str
+
+
+class UnderTest(HsmMixin):
+    @hsm.init_state
+    def state_TopA(self, signal: SignalType):
+        return self.hsm_states.state_TopB
+
+    def state_TopB(self, signal: SignalType):
+        return self.hsm_states.state_TopA
+
+    def entry_TopB(self, signal: SignalType):
+        time.sleep(0.002)
+
+    def exit_TopB(self, signal: SignalType):
+        pass
+
+
+def test_histogram():
+    histogram = HsmHistogram()
+    for duration_ns in (0, 1, 3, 1000, 1000):
+        histogram.add(duration_ns)
+    assert histogram.count == 5
+    assert histogram.total_ns == 2004
+    assert histogram.percentile_ns(50) == 3
+    assert histogram.percentile_ns(100) == 1023
+
+
+def test_profiler():
+    functions = [
+        (state.fn_handle, state.fn_entry, state.fn_exit)
+        for state in UnderTest.hsm_topology().states
+    ]
+
+    logger = HsmStringIoLogger()
+    sm = UnderTest(hsm_logger=logger)
+    sm.init()
+    with HsmProfiler(UnderTest) as profiler:
+        for _ in range(4):
+            sm.dispatch("x")
+        assert "_call_plan" in UnderTest.__dict__
+
+    assert "_call_plan" not in UnderTest.__dict__
+    assert functions == [
+        (state.fn_handle, state.fn_entry, state.fn_exit)
+        for state in UnderTest.hsm_topology().states
+    ]
+    assert ">>> TopA ==>entry_TopB==> TopB" in logger.get_log()
+
+    name, histogram = profiler.top(1)[0]
+    assert name == "entry_TopB"
+    assert histogram.count == 2
+    assert histogram.total_ns >= 4_000_000
+    assert profiler.histograms["state_TopA"].count == 2
+    (before, after), histogram = profiler.top_transitions(1)[0]
+    assert (before, after) == ("TopA", "TopB")
+    assert histogram.count == 2
+    assert "TopA ==> TopB" in profiler.dump()
+
+    sm.dispatch("x")
+    assert profiler.histograms["state_TopA"].count == 2
+
+
+class UnderTestAsync(AsyncHsmMixin):
+    @hsm.init_state
+    def state_TopA(self, signal: SignalType):
+        return self.hsm_states.state_TopB
+
+    def state_TopB(self, signal: SignalType):
+        return self.hsm_states.state_TopA
+
+    async def entry_TopB(self, signal: SignalType):
+        await asyncio.sleep(0.002)
+
+
+def test_profiler_async():
+    async def run():
+        sm = UnderTestAsync()
+        sm.init()
+        with HsmProfiler(UnderTestAsync) as profiler:
+            for _ in range(4):
+                await sm.dispatch("x")
+        assert sm.is_state(sm.state_TopA)
+        (before, after), histogram = profiler.top_transitions(1)[0]
+        assert (before, after) == ("TopA", "TopB")
+        assert histogram.count == 2
+        # The awaited entry-action is measured
+        assert histogram.total_ns >= 4_000_000
+        histogram = profiler.histograms["entry_TopB"]
+        assert histogram.count == 2
+        assert histogram.total_ns >= 4_000_000
+
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+from hsm import hsm
+from hsm.hsm import HsmMixin, HsmOutcome, HsmStringIoLogger
+from hsm.hsm_recorder import HsmRecorder
+
+SignalType = str
+
+
+class UnderTest(HsmMixin):
+    @hsm.init_state
+    def state_TopA(self, signal: SignalType):
+        if signal == "a":
+            return hsm.Transition(self.hsm_states.state_TopB, why="a received")
+        if signal == "i":
+            return hsm.Ignore(why="not now")
+        return hsm.HANDLED
+
+    def exit_TopA(self, signal: SignalType):
+        pass
+
+    def state_TopB(self, signal: SignalType):
+        if signal == "b":
+            return self.state_TopA
+        return hsm.HANDLED
+
+    def state_TopB_SubA(self, signal: SignalType):
+        return None
+
+    def entry_TopB_SubA(self, signal: SignalType):
+        pass
+
+
+def test_recorder_dump():
+    logger = HsmStringIoLogger()
+    recorder = HsmRecorder()
+    sm = UnderTest(hsm_logger=logger)
+    sm.add_logger(recorder)
+    sm.init()
+    for signal in ("x", "i", "a", "b", "a", "c", "b"):
+        sm.dispatch(signal)
+    assert len(recorder) == 7
+    assert recorder.dump() == logger.get_log()
+    assert "was handled by state_TopB" in recorder.dump()
+
+
+def test_recorder_ring():
+    recorder = HsmRecorder(capacity=3)
+    sm = UnderTest(hsm_logger=recorder)
+    sm.init()
+    for signal in ("a", "b", "x", "a", "b"):
+        sm.dispatch(signal)
+    assert recorder.count == 5
+    records = list(recorder.iter_records())
+    assert [record[6] for record in records] == [
+        HsmOutcome.HANDLED,
+        HsmOutcome.TRANSITION,
+        HsmOutcome.TRANSITION,
+    ]
+    _, before, after, target, handler, _, _, why = records[1]
+    assert (before.full_name, after.full_name) == ("TopA", "TopB_SubA")
+    assert (target.full_name, handler.full_name) == ("TopB", "TopA")
+    assert why == "a received"
+    timestamps = [record[0] for record in records]
+    assert timestamps == sorted(timestamps)
+
+
+class UnderTestUnhashable(HsmMixin):
+    @hsm.init_state
+    def state_TopA(self, signal: dict):
+        return hsm.Ignore(why=f"ignored {signal['n']}")
+
+
+def test_recorder_bounded():
+    recorder = HsmRecorder(capacity=3)
+    sm = UnderTestUnhashable(hsm_logger=recorder)
+    sm.init()
+    for n in range(1000):
+        sm.dispatch({"n": n})
+    records = list(recorder.iter_records())
+    assert [record[5] for record in records] == [{"n": 997}, {"n": 998}, {"n": 999}]
+    assert [record[7] for record in records] == [
+        "ignored 997",
+        "ignored 998",
+        "ignored 999",
+    ]
+    assert len(recorder._signals) == len(recorder._whys) == 3
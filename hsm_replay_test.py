@@ -0,0 +1,119 @@
+from hsm import hsm
+from hsm.hsm import HsmMixin
+from hsm.hsm_recorder import HsmRecorder
+from hsm.hsm_replay import HsmTrace, replay, replay_many, write_trace
+
+SignalType = str
+
+
+class UnderTest(HsmMixin):
+    THRESHOLD = 3
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ticks = 0
+
+    @hsm.init_state
+    def state_Idle(self, signal: SignalType):
+        if signal == "start":
+            return self.hsm_states.state_Running
+        return hsm.IGNORED
+
+    def state_Running(self, signal: SignalType):
+        if signal == "tick":
+            self.ticks += 1
+            if self.ticks >= self.THRESHOLD:
+                return self.hsm_states.state_Done
+            return hsm.HANDLED
+        return None
+
+    def state_Done(self, signal: SignalType):
+        if signal == "start":
+            self.ticks = 0
+            return self.hsm_states.state_Running
+        return hsm.HANDLED
+
+
+class UnderTestSlow(UnderTest):
+    THRESHOLD = 4
+
+
+class UnderTestRenamed(HsmMixin):
+    """
+    'Done' has been renamed to 'Finished'.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ticks = 0
+
+    @hsm.init_state
+    def state_Idle(self, signal: SignalType):
+        if signal == "start":
+            return self.hsm_states.state_Running
+        return hsm.IGNORED
+
+    def state_Running(self, signal: SignalType):
+        if signal == "tick":
+            self.ticks += 1
+            if self.ticks >= UnderTest.THRESHOLD:
+                return self.hsm_states.state_Finished
+            return hsm.HANDLED
+        return None
+
+    def state_Finished(self, signal: SignalType):
+        return hsm.HANDLED
+
+
+def record_trace(filename, signals) -> None:
+    recorder = HsmRecorder()
+    sm = UnderTest(hsm_logger=recorder)
+    sm.init()
+    for signal in signals:
+        sm.dispatch(signal)
+    assert write_trace(recorder, filename) == len(signals)
+
+
+def test_replay(tmp_path):
+    filename = tmp_path / "trace.bin"
+    signals = ["tick", "start"] + ["tick"] * 5 + ["start", "tick"]
+    record_trace(filename, signals)
+    trace = HsmTrace(filename)
+    assert trace.start == "Idle"
+    assert sorted(trace.signals) == ["start", "tick"]
+
+    result = replay(UnderTest, filename)
+    assert result.count == len(signals)
+    assert result.divergence is None
+
+    result = replay(UnderTestSlow, filename)
+    assert result.count == 5
+    assert result.divergence.index == 4
+    assert result.divergence.expected == "Done"
+    assert result.divergence.actual == "Running"
+    assert not result.divergence.unknown_state
+
+
+def test_replay_unknown_state(tmp_path):
+    filename = tmp_path / "trace.bin"
+    record_trace(filename, ["start", "tick", "tick", "tick"])
+
+    result = replay(UnderTestRenamed, filename)
+    assert result.count == 4
+    assert result.divergence.index == 3
+    assert result.divergence.expected == "Done"
+    assert result.divergence.actual == "Finished"
+    assert result.divergence.unknown_state
+
+
+def test_replay_many(tmp_path):
+    filenames = []
+    for i in range(4):
+        filename = tmp_path / f"trace{i}.bin"
+        record_trace(filename, ["start"] + ["tick"] * i)
+        filenames.append(filename)
+
+    results = replay_many(UnderTestSlow, filenames, max_workers=2)
+    assert [result.filename for result in results] == filenames
+    assert all(result.divergence is None for result in results[:3])
+    assert results[3].divergence.index == 3
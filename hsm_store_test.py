@@ -0,0 +1,79 @@
+import gc
+import sqlite3
+
+from hsm import hsm
+from hsm.hsm import HsmMixin
+from hsm.hsm_store import HsmStore
+
+SignalType = str
+
+
+class UnderTest(HsmMixin):
+    def __init__(self, key: str):
+        super().__init__()
+        self.key = key
+        self.entered = 0
+
+    @hsm.init_state
+    def state_Off(self, signal: SignalType):
+        return self.hsm_states.state_On
+
+    def state_On(self, signal: SignalType):
+        return self.hsm_states.state_Off
+
+    def entry_On(self, signal: SignalType):
+        self.entered += 1
+
+
+def count_rows(filename) -> int:
+    with sqlite3.connect(str(filename)) as connection:
+        return connection.execute("SELECT COUNT(*) FROM hsm_state").fetchone()[0]
+
+
+def test_store_write_behind(tmp_path):
+    filename = tmp_path / "hsm_store.db"
+    with HsmStore(
+        filename, factory=UnderTest, flush_count=10, flush_interval_s=3600.0
+    ) as store:
+        for i in range(9):
+            store.dispatch(f"sm{i}", "toggle")
+        assert count_rows(filename) == 0
+
+        store.dispatch("sm9", "toggle")
+        assert count_rows(filename) == 10
+
+        store.dispatch("sm0", "toggle")
+        assert count_rows(filename) == 10
+        assert "sm0" in store
+        assert "sm10" not in store
+
+    with HsmStore(filename, factory=UnderTest) as store:
+        sm0 = store.get("sm0")
+        assert sm0.is_state(sm0.state_Off)
+        sm1 = store.get("sm1")
+        assert sm1.is_state(sm1.state_On)
+        assert sm1.entered == 0
+        store.dispatch("sm1", "toggle")
+        assert sm1.is_state(sm1.state_Off)
+        assert store.flush() == 1
+
+
+def test_store_drops_flushed_machines(tmp_path):
+    filename = tmp_path / "hsm_store.db"
+    store = HsmStore(filename, factory=UnderTest, flush_count=10, flush_interval_s=3600.0)
+    store.dispatch("sm0", "toggle")
+    sm1 = store.get("sm1")
+    assert len(store._machines) == 2
+
+    store.flush()
+    gc.collect()
+    # 'sm0' is flushed and not referenced elsewhere: Dropped and loaded again
+    assert list(store._machines) == ["sm1"]
+    sm0 = store.get("sm0")
+    assert sm0.is_state(sm0.state_On)
+    assert sm0.entered == 0
+
+    store.close()
+    assert sm1._loggers == ()
+    sm1.dispatch("toggle")
+    assert count_rows(filename) == 2
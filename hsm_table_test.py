@@ -0,0 +1,95 @@
+import random
+
+import pytest
+
+from hsm import hsm
+from hsm.hsm_table import UNHANDLED, HsmTableMixin
+from hsm_testing import Parser
+
+SignalType = str
+
+
+def test_declared_targets():
+    sm = Parser()
+    sm.init()
+    sm.dispatch("start")
+    assert sm.is_state(sm.state_Frame_Data)
+    sm.dispatch("escape")
+    assert sm.is_state(sm.state_Frame_Escape)
+    with pytest.raises(Exception, match="Signal escape was not handled"):
+        sm.dispatch("escape")
+    sm.dispatch("stop")
+    assert sm.is_state(sm.state_Idle)
+    assert sm.events == [
+        ("entry_Frame", "start"),
+        ("entry_Frame_Escape", "escape"),
+        ("exit_Frame", "stop"),
+    ]
+
+
+def test_table():
+    table = Parser.hsm_table()
+    assert table.signals == ["byte", "escape", "start", "stop"]
+    state_idle = Parser.hsm_states.state_Idle
+    cell = state_idle.state_id * table.count_signals + table.signal_id("stop")
+    assert table.next_state[cell] == UNHANDLED
+    cell = state_idle.state_id * table.count_signals + table.signal_id("byte")
+    assert table.next_state[cell] == state_idle.state_id
+    assert table.plans[cell] is None
+
+
+def test_dispatch_id_equals_dispatch():
+    rnd = random.Random(42)
+    signals = Parser.hsm_table().signals
+    sm_a = Parser()
+    sm_b = Parser()
+    for sm in (sm_a, sm_b):
+        sm.init()
+    for _ in range(2000):
+        signal = rnd.choice(signals)
+        results = []
+        for sm, dispatch in (
+            (sm_a, lambda: sm_a.dispatch(signal)),
+            (sm_b, lambda: sm_b.dispatch_id(Parser.hsm_signal_id(signal))),
+        ):
+            try:
+                dispatch()
+                results.append(None)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                results.append(str(e))
+        assert results[0] == results[1]
+        assert sm_a.get_state() is sm_b.get_state()
+    assert sm_a.events == sm_b.events
+
+
+def test_dispatch_id_out_of_range():
+    sm = Parser()
+    sm.init()
+    sm.dispatch_id(Parser.hsm_signal_id("start"))
+    assert sm.is_state(sm.state_Frame_Data)
+    for signal_id in (-1, len(Parser.hsm_table().signals)):
+        with pytest.raises(ValueError, match=f"signal_id {signal_id} is out of range"):
+            sm.dispatch_id(signal_id)
+        assert sm.is_state(sm.state_Frame_Data)
+    assert sm.events == [("entry_Frame", "start")]
+
+
+def test_not_declarative():
+    class UnderTest(HsmTableMixin):
+        @hsm.init_state
+        @hsm.on("a")
+        def state_A(self, signal: SignalType):
+            return hsm.HANDLED
+
+    with pytest.raises(hsm.BadStatemachineException, match="Use '@hsm.on"):
+        UnderTest.hsm_table()
+
+
+def test_unknown_target():
+    class UnderTest(HsmTableMixin):
+        @hsm.on("a", to="state_B")
+        def state_A(self, signal: SignalType):
+            return None
+
+    with pytest.raises(hsm.BadStatemachineException, match="No such state"):
+        UnderTest.hsm_topology()
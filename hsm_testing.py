@@ -0,0 +1,117 @@
+"""
+Statemachines shared by the tests and 'hsm_benchmark.py'.
+"""
+
+import random
+from typing import Any, Callable, Dict, List
+
+from hsm import hsm
+from hsm.hsm_table import HsmTableMixin
+
+SignalType = str
+
+
+class Parser(HsmTableMixin):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    @hsm.init_state
+    @hsm.on("start", to="state_Frame")
+    @hsm.on("byte", to=hsm.IGNORED)
+    def state_Idle(self, signal: SignalType):
+        return None
+
+    @hsm.on("stop", to="state_Idle")
+    @hsm.on("start", to=hsm.HANDLED)
+    def state_Frame(self, signal: SignalType):
+        return None
+
+    @hsm.init_state
+    @hsm.on("byte", to=hsm.HANDLED)
+    @hsm.on("escape", to="state_Frame_Escape")
+    def state_Frame_Data(self, signal: SignalType):
+        return None
+
+    @hsm.on("byte", to="state_Frame_Data")
+    def state_Frame_Escape(self, signal: SignalType):
+        return None
+
+    def entry_Frame(self, signal: SignalType):
+        self.events.append(("entry_Frame", signal))
+
+    def exit_Frame(self, signal: SignalType):
+        self.events.append(("exit_Frame", signal))
+
+    def entry_Frame_Escape(self, signal: SignalType):
+        self.events.append(("entry_Frame_Escape", signal))
+
+
+SIGNAL_LEAF = "leaf"
+"Handled by the leaf states"
+SIGNAL_TOP = "top"
+"Handled by the toppest states: Bubbles up through all levels"
+SIGNAL_JUMP = "jump"
+"Transition between two toppest states: Exits and enters 'depth' levels"
+
+
+def make_machine(
+    depth: int, fanout: int, action_density: float = 0.0, seed: int = 0
+) -> type:
+    """
+    Return a HsmMixin subclass with a tree of states:
+    'depth' levels, every state having 'fanout' substates.
+    The first substate is always the init state.
+
+    The leaf states handle 'SIGNAL_LEAF', the toppest states handle
+    'SIGNAL_TOP' and 'SIGNAL_JUMP'. 'action_density' is the fraction of
+    states having entry- and exit-actions.
+    """
+    rnd = random.Random(seed)
+
+    def make_state_handler(
+        fn_name: str, is_init_state: bool, results: Dict[str, str]
+    ) -> Callable:
+        def fn(self, signal: Any):
+            result = results.get(signal, None)
+            if result is None:
+                return None
+            if result is hsm.HANDLED:
+                return result
+            return getattr(self.hsm_states, result)
+
+        fn.__name__ = fn_name
+        if is_init_state:
+            fn = hsm.init_state(fn)
+        return fn
+
+    def make_action(fn_name: str) -> Callable:
+        def fn(self, signal: Any):  # pylint: disable=unused-argument
+            pass
+
+        fn.__name__ = fn_name
+        return fn
+
+    namespace: Dict[str, Any] = {}
+    level: List[str] = [""]
+    for level_index in range(depth):
+        next_level: List[str] = []
+        for full_name in level:
+            for i in range(fanout):
+                name = f"{full_name}_S{i}" if full_name else f"S{i}"
+                fn_name = f"state_{name}"
+                results: Dict[str, Any] = {}
+                if level_index == 0:
+                    results[SIGNAL_TOP] = hsm.HANDLED
+                    results[SIGNAL_JUMP] = f"state_S{(i + 1) % fanout}"
+                if level_index == depth - 1:
+                    results[SIGNAL_LEAF] = hsm.HANDLED
+                namespace[fn_name] = make_state_handler(
+                    fn_name, is_init_state=i == 0, results=results
+                )
+                if rnd.random() < action_density:
+                    for verb in ("entry_", "exit_"):
+                        namespace[f"{verb}{name}"] = make_action(f"{verb}{name}")
+                next_level.append(name)
+        level = next_level
+    return type(f"Machine_d{depth}_f{fanout}", (hsm.HsmMixin,), namespace)
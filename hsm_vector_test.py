@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from hsm_testing import Parser
+
+np = pytest.importorskip("numpy")
+
+from hsm.hsm_vector import HsmVector  # noqa: E402  # pylint: disable=wrong-import-position
+
+
+def test_vector_equals_dispatch():
+    count_machines = 300
+    rnd = random.Random(7)
+    signals = Parser.hsm_table().signals
+
+    machines_dispatch = [Parser() for _ in range(count_machines)]
+    machines_vector = [Parser() for _ in range(count_machines)]
+    for sm in machines_dispatch + machines_vector:
+        sm.init()
+    vector = HsmVector(Parser, count=count_machines)
+    vector.load(machines_vector)
+
+    for _ in range(50):
+        signal_ids = [rnd.randrange(len(signals)) for _ in range(count_machines)]
+        step = vector.step(np.array(signal_ids))
+        vector.call_actions(step, machines_vector)
+
+        for i, (sm, signal_id) in enumerate(zip(machines_dispatch, signal_ids)):
+            try:
+                sm.dispatch(signals[signal_id])
+                assert not step.unhandled[i]
+            except Exception:  # pylint: disable=broad-exception-caught
+                assert step.unhandled[i]
+            assert sm.get_state().state_id == vector.state_ids[i]
+
+    vector.store(machines_vector)
+    for sm_dispatch, sm_vector in zip(machines_dispatch, machines_vector):
+        assert sm_dispatch.get_state() is sm_vector.get_state()
+        assert sm_dispatch.events == sm_vector.events
+
+
+def test_vector_same_signal():
+    vector = HsmVector(Parser, count=4)
+    step = vector.step(Parser.hsm_signal_id("start"))
+    assert step.actions.all()
+    state_id = Parser.hsm_states.state_Frame_Data.state_id
+    assert (vector.state_ids == state_id).all()
+
+
+def test_vector_signal_id_out_of_range():
+    vector = HsmVector(Parser, count=3)
+    state_ids = vector.state_ids.copy()
+    for signal_id in (-1, len(Parser.hsm_table().signals)):
+        with pytest.raises(ValueError, match="out of range"):
+            vector.step(np.array([0, signal_id, 0]))
+        assert (vector.state_ids == state_ids).all()
@@ -11,6 +11,7 @@ setup(
     author_email="hans@maerki.com",
     url="https://github.com/hmaerki/HierarchicalStateMachine",
     install_requires=[],
+    extras_require={"numpy": ["numpy"]},
     packages=["hsm"],
     package_data={},
     keywords=["hierarchical state machine"],